@@ -0,0 +1,112 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+
+# Database methods that only read. Everything else is treated as a write.
+READ_PREFIXES = ('get_', 'is_', 'are_', 'search_')
+READ_METHODS = {'login_user'}
+
+class AsyncDatabase:
+    """Coroutine facade over Database for callers that must not block.
+    
+    Every public Database method is available under the same name as a
+    coroutine, e.g. `await adb.get_conversation(a, b)`. Calls run on
+    executor threads, and each thread checks its own connection out of the
+    Database pool. Writes are serialized through a single writer thread,
+    so they keep the order they were issued in. Reads run in parallel on
+    the reader threads, which WAL allows next to the writer.
+    
+    Headless tools can use it from any asyncio loop. A Tk app calls
+    attach_tk(), which runs a private loop from root.after(), and hands
+    coroutines to submit() with a callback for the result.
+    """
+    
+    def __init__(self, db=None, db_name='chat_app.db', profile='desktop', readers=4):
+        self.db = db if db is not None else Database(db_name, profile)
+        # Readers plus the writer must fit in the pool next to the Tk thread
+        if self.db.pool_size < 3:
+            raise ValueError("AsyncDatabase needs a Database with pool_size of at least 3")
+        readers = max(1, min(readers, self.db.pool_size - 2))
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._loop = None
+        self._root = None
+        self._pump_id = None
+    
+    @staticmethod
+    def is_read(name):
+        """Whether a Database method only reads, and can run next to other reads"""
+        return name.startswith(READ_PREFIXES) or name in READ_METHODS
+    
+    def __getattr__(self, name):
+        # Only reached for Database methods, wrapped once and kept
+        if name.startswith('_') or name in ('close', 'connect', 'conn'):
+            raise AttributeError(name)
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+        
+        executor = self._readers if self.is_read(name) else self._writer
+        
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+        
+        self.__dict__[name] = call
+        return call
+    
+    # ============= TK INTEGRATION =============
+    
+    def attach_tk(self, root, interval=10):
+        """Drive a private event loop from root.after() every `interval` ms"""
+        self._root = root
+        self._loop = asyncio.new_event_loop()
+        self._pump(interval)
+    
+    def _pump(self, interval):
+        """Run the callbacks that are ready on the loop, then reschedule"""
+        self._loop.call_soon(self._loop.stop)
+        self._loop.run_forever()
+        self._pump_id = self._root.after(interval, self._pump, interval)
+    
+    def submit(self, coro, callback=None, error_callback=None):
+        """Run a coroutine on the Tk loop; callbacks get its result on the Tk thread
+        
+        Returns the task, so the caller can cancel() it if the result is no
+        longer wanted. Cancelled tasks call neither callback.
+        """
+        task = self._loop.create_task(coro)
+        
+        def done(task):
+            if task.cancelled():
+                return
+            error = task.exception()
+            if error is None:
+                if callback:
+                    callback(task.result())
+            elif error_callback:
+                error_callback(error)
+            else:
+                print(f"Error in database task: {error}")
+        
+        task.add_done_callback(done)
+        return task
+    
+    def close(self):
+        """Finish queued calls, stop the Tk pump and close the database"""
+        if self._pump_id is not None:
+            self._root.after_cancel(self._pump_id)
+            self._pump_id = None
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        if self._loop is not None:
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.call_soon(self._loop.stop)
+            self._loop.run_forever()
+            self._loop.close()
+            self._loop = None
+        self.db.close()
@@ -0,0 +1,94 @@
+"""Direct message send throughput, before and after the single-transaction send
+
+Usage: python bench_send.py [sends] [profile]
+
+Times two ways of sending `sends` messages between two friends, each on a
+fresh temporary database opened with the given tuning profile, once with
+the profile's synchronous setting and once with synchronous=FULL, where
+every commit waits for an fsync:
+
+  separate commits  the old path: checks and insert, update_streak()
+                    committing on its own, then the caller's mark_as_read()
+                    with a second commit
+  send_message      the current path: everything in one transaction
+
+The old path also skips the conversation summary upkeep the current one
+does, so its numbers flatter it. The results are printed and written to
+bench_output.txt.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from database import PROFILES, Database, conversation_key, _now_ms
+
+
+def send_with_separate_commits(db, sender_id, receiver_id, message_text):
+    """Send a message the way the app did before send_message used one transaction"""
+    if db.is_blocked(sender_id, receiver_id) or not db.are_friends(sender_id, receiver_id):
+        return None
+    
+    cursor = db.conn.cursor()
+    cursor.execute('''
+        INSERT INTO messages (sender_id, receiver_id, conversation_id, message_text, sent_at_ms)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (sender_id, receiver_id, conversation_key(sender_id, receiver_id), message_text, _now_ms()))
+    message_id = cursor.lastrowid
+    
+    # update_streak commits the insert along with the streak
+    db.update_streak(sender_id, receiver_id)
+    db.conn.commit()
+    
+    # The caller then marked its own message read in another transaction
+    db.mark_as_read(message_id, sender_id, 'direct')
+    return message_id
+
+
+def send_in_one_transaction(db, sender_id, receiver_id, message_text):
+    """Send a message with the current single-transaction send_message"""
+    return db.send_message(sender_id, receiver_id, message_text)[2]
+
+
+def time_sends(send, sends, profile, synchronous=None):
+    """Sends per second for `sends` messages from alice to bob on a fresh database"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), profile)
+        try:
+            db.send_friend_request(1, 'bob')
+            db.respond_to_friend_request(db.get_pending_friend_requests(2)[0]['request_id'], 2)
+            if synchronous:
+                db.conn.execute(f'PRAGMA synchronous = {synchronous}')
+            
+            start = time.perf_counter()
+            for index in range(sends):
+                if send(db, 1, 2, f"bot message {index}") is None:
+                    raise RuntimeError("Send failed")
+            elapsed = time.perf_counter() - start
+        finally:
+            db.close()
+    return sends / elapsed
+
+
+def main():
+    sends = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    profile = sys.argv[2] if len(sys.argv) > 2 else 'desktop'
+    
+    lines = []
+    for synchronous in (None, 'FULL'):
+        results = [(name, time_sends(send, sends, profile, synchronous)) for name, send in (
+            ('separate commits', send_with_separate_commits),
+            ('send_message', send_in_one_transaction),
+        )]
+        lines.append(f"{sends} sends, '{profile}' profile, synchronous="
+                     f"{synchronous or PROFILES[profile]['synchronous']}")
+        lines += [f"{name:>16}: {rate:,.0f} sends/s" for name, rate in results]
+        lines.append(f"{'speedup':>16}: {results[1][1] / results[0][1]:.2f}x")
+    report = "\n".join(lines)
+    print(report)
+    with open('bench_output.txt', 'w') as f:
+        f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
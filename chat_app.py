@@ -1,23 +1,58 @@
 import tkinter as tk
 from tkinter import messagebox, scrolledtext, ttk, filedialog
-from database import Database
+from database import Database, HIGHLIGHT_START, HIGHLIGHT_END
+from async_database import AsyncDatabase
 from datetime import datetime
+import asyncio
+import functools
 import os
 import shutil
 from PIL import Image, ImageTk
 
 class ChatApp:
+    # Messages fetched per history page, on open and on each scroll-back
+    HISTORY_PAGE_SIZE = 50
+    # Friends fetched per page of the Friends panel
+    FRIENDS_PAGE_SIZE = 100
+    # Characters of the last message shown under a chat in the side panels
+    PREVIEW_CHARS = 30
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Chat Application")
         self.root.geometry("800x600")
         
         self.db = Database()
+        # Chat loads and sends run on worker threads and report back through
+        # root.after, so a slow query never blocks the window
+        self.db_worker = AsyncDatabase(self.db)
+        self.db_worker.attach_tk(self.root)
+        self._db_tasks = {}  # channel -> task of the latest call on it
+        self._db_generations = {}  # channel -> token of the latest call on it
+        self._db_session = 0  # bumped on logout to drop every pending result
         self.current_user = None
         self.selected_user = None
         self.selected_group = None
         self.chat_mode = 'direct'  # 'direct' or 'group'
         
+        # Friends and groups shown in the side panels, in listbox order
+        self.friends = []
+        self.groups = []
+        self.friends_has_more = False
+        self._friends_loading = False
+        
+        # Keyset pagination state of the open DM conversation
+        self.dm_oldest_id = None
+        self.dm_newest_id = None
+        self.dm_has_older = False
+        self._dm_loading_older = False
+        
+        # Same for the open group chat
+        self.group_oldest_id = None
+        self.group_newest_id = None
+        self.group_has_older = False
+        self._group_loading_older = False
+        
         # Create images directory if it doesn't exist
         self.images_dir = 'chat_images'
         if not os.path.exists(self.images_dir):
@@ -26,8 +61,56 @@ class ChatApp:
         # Create login screen
         self.create_login_screen()
     
+    def run_db(self, coro, callback=None, channel=None):
+        """Run a database coroutine on the worker; callback gets its result on the Tk thread
+        
+        A new call on a channel supersedes the one before it: that task is
+        cancelled, and its result is dropped if it had already finished.
+        """
+        if channel is not None:
+            self.cancel_db(channel)
+        token = (self._db_session, self._db_generations.get(channel))
+        
+        def deliver(result):
+            if callback and token == (self._db_session, self._db_generations.get(channel)):
+                callback(result)
+        
+        task = self.db_worker.submit(coro, deliver)
+        if channel is not None:
+            self._db_tasks[channel] = task
+        return task
+    
+    def cancel_db(self, *channels):
+        """Drop the in-flight calls on the given channels"""
+        for channel in channels:
+            self._db_generations[channel] = self._db_generations.get(channel, 0) + 1
+            task = self._db_tasks.pop(channel, None)
+            if task:
+                task.cancel()
+    
+    async def fetch_page(self, message_type, query, peer_id=None):
+        """Await a page of messages with its reactions and read receipts
+        
+        query is a partial of the worker's history method; peer_id is the
+        other user of a direct chat, whose read receipts are shown.
+        """
+        messages = await query()
+        message_ids = [msg['message_id'] for msg in messages]
+        reactions = self.db_worker.get_reactions_for_messages(message_ids, message_type)
+        if message_type == 'direct':
+            own_ids = [msg['message_id'] for msg in messages
+                       if msg['sender_id'] == self.current_user['user_id']]
+            reactions, read_ids = await asyncio.gather(
+                reactions, self.db_worker.get_read_status(own_ids, peer_id, 'direct'))
+        else:
+            reactions, read_ids = await reactions, set()
+        return messages, reactions, read_ids
+    
     def create_login_screen(self):
         """Create login interface"""
+        # Results of the previous session's calls have no widgets to go to
+        self._db_session += 1
+        self.cancel_db(*list(self._db_tasks))
         self.clear_screen()
         
         # Login frame
@@ -295,7 +378,8 @@ class ChatApp:
         
         # Users listbox
         self.users_listbox = tk.Listbox(left_panel, font=('Arial', 11), 
-                                        bg='#ecf0f1', selectbackground='#3498db')
+                                        bg='#ecf0f1', selectbackground='#3498db',
+                                        yscrollcommand=self.on_friends_scroll)
         self.users_listbox.pack(expand=True, fill='both', padx=5, pady=5)
         self.users_listbox.bind('<<ListboxSelect>>', self.on_user_select)
         
@@ -351,6 +435,7 @@ class ChatApp:
         self.dm_chat_display = scrolledtext.ScrolledText(right_panel, state='disabled', 
                                                          wrap=tk.WORD, font=('Arial', 10))
         self.dm_chat_display.pack(expand=True, fill='both', padx=10, pady=10)
+        self.dm_chat_display.config(yscrollcommand=self.on_dm_scroll)
         
         # Message input area
         input_frame = tk.Frame(right_panel)
@@ -452,6 +537,7 @@ class ChatApp:
         self.group_chat_display = scrolledtext.ScrolledText(right_panel, state='disabled', 
                                                             wrap=tk.WORD, font=('Arial', 10))
         self.group_chat_display.pack(expand=True, fill='both', padx=10, pady=10)
+        self.group_chat_display.config(yscrollcommand=self.on_group_scroll)
         
         # Group message input area
         group_input_frame = tk.Frame(right_panel)
@@ -875,11 +961,7 @@ class ChatApp:
             return
         
         # Get all users except current members
-        all_users = self.db.get_all_users()
-        members = self.db.get_group_members(self.selected_group['group_id'])
-        member_ids = [m['user_id'] for m in members]
-        
-        available_users = [u for u in all_users if u['user_id'] not in member_ids]
+        available_users = self.db.get_all_users(exclude_group_id=self.selected_group['group_id'])
         
         if not available_users:
             messagebox.showinfo("Info", "All users are already members of this group", 
@@ -915,21 +997,19 @@ class ChatApp:
                                      parent=invite_dialog)
                 return
             
-            success_count = 0
-            for idx in selected:
-                user = available_users[idx]
-                success, msg = self.db.invite_to_group(
-                    self.selected_group['group_id'],
-                    self.current_user['user_id'],
-                    user['user_id']
-                )
-                if success:
-                    success_count += 1
+            results = self.db.invite_many(
+                self.selected_group['group_id'],
+                self.current_user['user_id'],
+                [available_users[idx]['user_id'] for idx in selected]
+            )
+            success_count = sum(1 for success, msg in results.values() if success)
+            skipped = len(results) - success_count
             
             if success_count > 0:
-                messagebox.showinfo("Success", 
-                                  f"Sent {success_count} invitation(s) successfully!", 
-                                  parent=invite_dialog)
+                summary = f"Sent {success_count} invitation(s) successfully!"
+                if skipped:
+                    summary += f"\n{skipped} user(s) skipped (already invited or a member)."
+                messagebox.showinfo("Success", summary, parent=invite_dialog)
                 invite_dialog.destroy()
             else:
                 messagebox.showerror("Error", "Failed to send invitations", 
@@ -947,18 +1027,111 @@ class ChatApp:
                  cursor='hand2', width=15).pack(side='left', padx=5)
     
     def load_users(self):
-        """Load friends into the listbox"""
+        """Load friends into the listbox, most recent chats first"""
         self.users_listbox.delete(0, tk.END)
-        friends = self.db.get_friends(self.current_user['user_id'])
-        
-        for friend in friends:
-            display_name = friend.get('display_name') or friend['username']
-            self.users_listbox.insert(tk.END, display_name)
+        self.friends = []
+        self.friends_has_more = True
+        self.load_more_friends()
         
         # If no friends, show message
-        if not friends:
+        if not self.friends:
             self.users_listbox.insert(tk.END, "No friends yet")
     
+    def load_more_friends(self):
+        """Append the next page of friends to the listbox"""
+        self._friends_loading = False
+        if not self.friends_has_more:
+            return
+        
+        before = None
+        if self.friends:
+            before = (self.friends[-1]['last_activity_ms'], self.friends[-1]['user_id'])
+        friends = self.db.get_friend_summaries(self.current_user['user_id'], before=before,
+                                               limit=self.FRIENDS_PAGE_SIZE)
+        self.friends_has_more = len(friends) == self.FRIENDS_PAGE_SIZE
+        
+        for index, friend in enumerate(friends, start=len(self.friends)):
+            self.users_listbox.insert(tk.END, self.friend_line(friend))
+            if self.selected_user and friend['user_id'] == self.selected_user['user_id']:
+                self.users_listbox.selection_set(index)
+        self.friends.extend(friends)
+    
+    def chat_summary_text(self, name, summary):
+        """Side panel line for a chat: its name, unread badge and a preview of the last message"""
+        if summary['unread_count']:
+            name = f"{name}  🔴 {summary['unread_count']}"
+        preview = summary['preview']
+        if preview is None:
+            return name
+        if len(preview) > self.PREVIEW_CHARS:
+            preview = preview[:self.PREVIEW_CHARS] + '…'
+        if summary['last_sender_id'] == self.current_user['user_id']:
+            preview = f"You: {preview}"
+        return f"{name}  ·  {preview}"
+    
+    def friend_line(self, friend):
+        """Friends panel line for a friend summary"""
+        return self.chat_summary_text(friend.get('display_name') or friend['username'], friend)
+    
+    def group_line(self, group):
+        """Groups panel line for a group summary"""
+        role_badge = " 👑" if group['role'] == 'admin' else ""
+        return self.chat_summary_text(f"{group['group_avatar']} {group['group_name']}{role_badge}", group)
+    
+    def refresh_unread_badges(self):
+        """Update the side panels' unread badges in place from one background counts query"""
+        self.run_db(self.db_worker.get_unread_counts(self.current_user['user_id']),
+                    self.show_unread_badges, 'badges')
+    
+    def show_unread_badges(self, counts):
+        """Rewrite the side panel lines whose unread count changed"""
+        panels = ((self.users_listbox, self.friends, 'direct', 'user_id', self.friend_line),
+                  (self.groups_listbox, self.groups, 'group', 'group_id', self.group_line))
+        for listbox, chats, message_type, key, line in panels:
+            for index, chat in enumerate(chats):
+                unread_count = counts[message_type].get(chat[key], 0)
+                if unread_count == chat['unread_count']:
+                    continue
+                chat['unread_count'] = unread_count
+                selected = listbox.selection_includes(index)
+                listbox.delete(index)
+                listbox.insert(index, line(chat))
+                if selected:
+                    listbox.selection_set(index)
+    
+    def refresh_panels(self):
+        """Reload the side panels in the background, keeping the friends already paged in"""
+        limit = max(len(self.friends), self.FRIENDS_PAGE_SIZE)
+        self.run_db(self.fetch_panels(limit), functools.partial(self.show_panels, limit=limit), 'panels')
+    
+    async def fetch_panels(self, limit):
+        """Await the first `limit` friend summaries and all group summaries"""
+        user_id = self.current_user['user_id']
+        return await asyncio.gather(self.db_worker.get_friend_summaries(user_id, limit=limit),
+                                    self.db_worker.get_group_summaries(user_id))
+    
+    def show_panels(self, summaries, limit):
+        """Refill both side panels from refresh_panels, keeping selection and scroll position"""
+        self.friends, self.groups = summaries
+        self.friends_has_more = len(self.friends) == limit
+        
+        panels = ((self.users_listbox, self.friends, 'user_id', self.selected_user, self.friend_line),
+                  (self.groups_listbox, self.groups, 'group_id', self.selected_group, self.group_line))
+        for listbox, chats, key, selected, line in panels:
+            top = listbox.yview()[0]
+            listbox.delete(0, tk.END)
+            for index, chat in enumerate(chats):
+                listbox.insert(tk.END, line(chat))
+                if selected and chat[key] == selected[key]:
+                    listbox.selection_set(index)
+            listbox.yview_moveto(top)
+    
+    def on_friends_scroll(self, first, last):
+        """Listbox scroll callback; loads the next page of friends at the bottom"""
+        if float(last) >= 1.0 and self.friends_has_more and not self._friends_loading:
+            self._friends_loading = True
+            self.root.after_idle(self.load_more_friends)
+    
     def add_friend_dialog(self):
         """Dialog to send a friend request"""
         dialog = tk.Toplevel(self.root)
@@ -1009,14 +1182,14 @@ class ChatApp:
         username_entry.bind('<Return>', lambda e: send_request())
     
     def load_groups(self):
-        """Load user's groups into the listbox"""
+        """Load user's groups into the listbox, most recent chats first"""
         self.groups_listbox.delete(0, tk.END)
-        groups = self.db.get_user_groups(self.current_user['user_id'])
+        self.groups = self.db.get_group_summaries(self.current_user['user_id'])
         
-        for group in groups:
-            role_badge = " 👑" if group['role'] == 'admin' else ""
-            display_text = f"{group['group_avatar']} {group['group_name']}{role_badge}"
-            self.groups_listbox.insert(tk.END, display_text)
+        for index, group in enumerate(self.groups):
+            self.groups_listbox.insert(tk.END, self.group_line(group))
+            if self.selected_group and group['group_id'] == self.selected_group['group_id']:
+                self.groups_listbox.selection_set(index)
     
     def update_streak_display(self):
         """Update the streak display in chat header"""
@@ -1024,8 +1197,11 @@ class ChatApp:
             self.dm_streak_label.config(text="")
             return
         
-        streak = self.db.get_streak(self.current_user['user_id'], self.selected_user['user_id'])
-        
+        self.run_db(self.db_worker.get_streak(self.current_user['user_id'], self.selected_user['user_id']),
+                    self.show_streak, 'streak')
+    
+    def show_streak(self, streak):
+        """Show a streak fetched by update_streak_display"""
         if streak and streak['streak_count'] > 0:
             self.dm_streak_label.config(text=f"🔥 {streak['streak_count']} day streak")
         else:
@@ -1035,32 +1211,25 @@ class ChatApp:
         """Handle user selection from list"""
         selection = self.users_listbox.curselection()
         if selection:
-            display_name = self.users_listbox.get(selection[0])
-            
             # Don't do anything if it's the "No friends yet" message
-            if display_name == "No friends yet":
+            if selection[0] >= len(self.friends):
                 return
             
-            friends = self.db.get_friends(self.current_user['user_id'])
-            
-            for friend in friends:
-                friend_display = friend.get('display_name') or friend['username']
-                if friend_display == display_name:
-                    self.selected_user = friend
-                    self.dm_selected_label.config(text=f"💬 Chatting with: {friend_display}")
-                    self.dm_view_profile_btn.config(state='normal')
-                    self.dm_clear_chat_btn.config(state='normal')
-                    self.update_streak_display()
-                    self.load_dm_conversation()
-                    break
+            friend = self.friends[selection[0]]
+            friend_display = friend.get('display_name') or friend['username']
+            self.selected_user = friend
+            self.dm_selected_label.config(text=f"💬 Chatting with: {friend_display}")
+            self.dm_view_profile_btn.config(state='normal')
+            self.dm_clear_chat_btn.config(state='normal')
+            self.update_streak_display()
+            self.load_dm_conversation()
     
     def on_group_select(self, event):
         """Handle group selection from list"""
         selection = self.groups_listbox.curselection()
         if selection:
-            groups = self.db.get_user_groups(self.current_user['user_id'])
-            if selection[0] < len(groups):
-                self.selected_group = groups[selection[0]]
+            if selection[0] < len(self.groups):
+                self.selected_group = self.groups[selection[0]]
                 group_name = self.selected_group['group_name']
                 self.group_selected_label.config(text=f"👥 {group_name}")
                 self.group_info_btn.config(state='normal')
@@ -1069,10 +1238,26 @@ class ChatApp:
                 self.load_group_conversation()
     
     def load_dm_conversation(self):
-        """Load direct message conversation with selected user"""
+        """Load the latest page of the conversation with the selected user
+        
+        The page is fetched in the background; selecting another chat
+        before it arrives cancels it.
+        """
         if not self.selected_user:
             return
         
+        # Scroll-back and appends wait for the new page's cursors
+        self.cancel_db('dm_older')
+        self.dm_has_older = False
+        self.dm_newest_id = None
+        query = functools.partial(self.db_worker.get_conversation, self.current_user['user_id'],
+                                  self.selected_user['user_id'], limit=self.HISTORY_PAGE_SIZE)
+        self.run_db(self.fetch_page('direct', query, self.selected_user['user_id']),
+                    self.show_dm_conversation, 'dm')
+    
+    def show_dm_conversation(self, page):
+        """Replace the DM display with a page fetched by load_dm_conversation"""
+        messages = page[0]
         self.dm_chat_display.config(state='normal')
         self.dm_chat_display.delete('1.0', tk.END)
         
@@ -1082,148 +1267,18 @@ class ChatApp:
         else:
             self._image_refs = []
         
-        messages = self.db.get_conversation(self.current_user['user_id'], 
-                                           self.selected_user['user_id'])
+        # Keyset cursors for scroll-back and for appending new messages
+        self.dm_has_older = len(messages) == self.HISTORY_PAGE_SIZE
+        self.dm_oldest_id = messages[0]['message_id'] if messages else None
+        self.dm_newest_id = messages[-1]['message_id'] if messages else None
+        self._dm_loading_older = False
         
         selected_display = self.selected_user.get('display_name') or self.selected_user['username']
         
         if not messages:
             self.dm_chat_display.insert(tk.END, f"No messages yet with {selected_display}\n")
         else:
-            for msg in messages:
-                sender = msg['sender_name']
-                timestamp = msg['sent_at'].strftime('%I:%M %p')
-                text = msg['message_text']
-                image_path = msg.get('image_path')
-                message_id = msg['message_id']
-                is_edited = msg.get('is_edited', 0)
-                is_own = msg['sender_id'] == self.current_user['user_id']
-                
-                if is_own:
-                    self.dm_chat_display.insert(tk.END, f"You [{timestamp}]", 'you')
-                else:
-                    self.dm_chat_display.insert(tk.END, f"{sender} [{timestamp}]", 'them')
-                
-                # Show edited indicator
-                if is_edited:
-                    self.dm_chat_display.insert(tk.END, " (edited)", 'edited')
-                
-                self.dm_chat_display.insert(tk.END, ":\n")
-                
-                # Display image if present
-                if image_path and os.path.exists(image_path):
-                    try:
-                        # Load and resize image
-                        img = Image.open(image_path)
-                        img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                        photo = ImageTk.PhotoImage(img)
-                        
-                        # Insert image
-                        self.dm_chat_display.insert(tk.END, "\n")
-                        self.dm_chat_display.image_create(tk.END, image=photo)
-                        self.dm_chat_display.insert(tk.END, "\n")
-                        
-                        # Keep reference to prevent garbage collection
-                        self._image_refs.append(photo)
-                    except Exception as e:
-                        self.dm_chat_display.insert(tk.END, f"[Image - Error loading: {str(e)}]\n")
-                
-                # Display text message
-                if text and text != "[Image]":
-                    self.dm_chat_display.insert(tk.END, f"{text}\n")
-                elif not image_path:
-                    self.dm_chat_display.insert(tk.END, "\n")
-                
-                # Show reactions
-                reactions = self.db.get_message_reactions(message_id, 'direct')
-                if reactions:
-                    reaction_text = " ".join([r['reaction_type'] for r in reactions])
-                    self.dm_chat_display.insert(tk.END, f"  {reaction_text}\n", 'reactions')
-                
-                # Show read receipt for own messages
-                if is_own:
-                    is_read = self.db.is_message_read(message_id, self.selected_user['user_id'], 'direct')
-                    read_indicator = "✓✓" if is_read else "✓"
-                    self.dm_chat_display.insert(tk.END, f"  {read_indicator}\n", 'read_receipt')
-                else:
-                    # Mark as read when viewing
-                    self.db.mark_as_read(message_id, self.current_user['user_id'], 'direct')
-                
-                # Add action buttons for own messages
-                if is_own:
-                    start_pos = self.dm_chat_display.index(tk.END + "-2l")
-                    self.dm_chat_display.insert(tk.END, "  [React] [Edit] [Delete] [Forward]\n", 'actions')
-                    end_pos = self.dm_chat_display.index(tk.END + "-1l")
-                    
-                    # Use unique tag names for each message to avoid conflicts
-                    react_tag = f"react_btn_{message_id}"
-                    edit_tag = f"edit_btn_{message_id}"
-                    delete_tag = f"delete_btn_{message_id}"
-                    forward_tag = f"forward_btn_{message_id}"
-                    
-                    # Make action buttons clickable
-                    def on_react(e, mid=message_id):
-                        self.show_reaction_menu(mid, 'direct', e.x_root, e.y_root)
-                    def on_edit(e, mid=message_id, txt=text):
-                        self.edit_message_dialog(mid, txt, 'direct')
-                    def on_delete(e, mid=message_id):
-                        self.delete_message_confirm(mid, 'direct')
-                    def on_forward(e, mid=message_id):
-                        self.forward_message_dialog(mid, 'direct')
-                    
-                    # Find positions for each action
-                    react_start = self.dm_chat_display.search("  [React]", start_pos, end_pos)
-                    react_end = self.dm_chat_display.search("]", react_start, end_pos) + "+1c"
-                    self.dm_chat_display.tag_add(react_tag, react_start, react_end)
-                    self.dm_chat_display.tag_config(react_tag, foreground='#3498db', underline=True)
-                    self.dm_chat_display.tag_bind(react_tag, "<Button-1>", on_react)
-                    
-                    edit_start = self.dm_chat_display.search("[Edit]", react_end, end_pos)
-                    edit_end = self.dm_chat_display.search("]", edit_start, end_pos) + "+1c"
-                    self.dm_chat_display.tag_add(edit_tag, edit_start, edit_end)
-                    self.dm_chat_display.tag_config(edit_tag, foreground='#2ecc71', underline=True)
-                    self.dm_chat_display.tag_bind(edit_tag, "<Button-1>", on_edit)
-                    
-                    delete_start = self.dm_chat_display.search("[Delete]", edit_end, end_pos)
-                    delete_end = self.dm_chat_display.search("]", delete_start, end_pos) + "+1c"
-                    self.dm_chat_display.tag_add(delete_tag, delete_start, delete_end)
-                    self.dm_chat_display.tag_config(delete_tag, foreground='#e74c3c', underline=True)
-                    self.dm_chat_display.tag_bind(delete_tag, "<Button-1>", on_delete)
-                    
-                    forward_start = self.dm_chat_display.search("[Forward]", delete_end, end_pos)
-                    forward_end = self.dm_chat_display.search("]", forward_start, end_pos) + "+1c"
-                    self.dm_chat_display.tag_add(forward_tag, forward_start, forward_end)
-                    self.dm_chat_display.tag_config(forward_tag, foreground='#9b59b6', underline=True)
-                    self.dm_chat_display.tag_bind(forward_tag, "<Button-1>", on_forward)
-                
-                # Add reaction button for other's messages
-                else:
-                    start_pos = self.dm_chat_display.index(tk.END + "-1l")
-                    self.dm_chat_display.insert(tk.END, "  [React] [Forward]\n", 'actions')
-                    end_pos = self.dm_chat_display.index(tk.END + "-1l")
-                    
-                    # Use unique tag names for each message
-                    react_tag = f"react_btn_{message_id}"
-                    forward_tag = f"forward_btn_{message_id}"
-                    
-                    def on_react(e, mid=message_id):
-                        self.show_reaction_menu(mid, 'direct', e.x_root, e.y_root)
-                    def on_forward(e, mid=message_id):
-                        self.forward_message_dialog(mid, 'direct')
-                    
-                    react_start = self.dm_chat_display.search("  [React]", start_pos, end_pos)
-                    react_end = self.dm_chat_display.search("]", react_start, end_pos) + "+1c"
-                    self.dm_chat_display.tag_add(react_tag, react_start, react_end)
-                    self.dm_chat_display.tag_config(react_tag, foreground='#3498db', underline=True)
-                    self.dm_chat_display.tag_bind(react_tag, "<Button-1>", on_react)
-                    
-                    forward_start = self.dm_chat_display.search("[Forward]", react_end, end_pos)
-                    forward_end = self.dm_chat_display.search("]", forward_start, end_pos) + "+1c"
-                    self.dm_chat_display.tag_add(forward_tag, forward_start, forward_end)
-                    self.dm_chat_display.tag_config(forward_tag, foreground='#9b59b6', underline=True)
-                    self.dm_chat_display.tag_bind(forward_tag, "<Button-1>", on_forward)
-                
-                self.dm_chat_display.insert(tk.END, "\n")
+            self.render_messages(self.dm_chat_display, page, 'direct', tk.END)
         
         self.dm_chat_display.tag_config('you', foreground='#2980b9', font=('Arial', 10, 'bold'))
         self.dm_chat_display.tag_config('them', foreground='#27ae60', font=('Arial', 10, 'bold'))
@@ -1233,15 +1288,188 @@ class ChatApp:
         self.dm_chat_display.tag_config('read_receipt', foreground='#3498db', font=('Arial', 9))
         self.dm_chat_display.config(state='disabled')
         self.dm_chat_display.see(tk.END)
+    
+    def on_dm_scroll(self, first, last):
+        """Scrollbar callback for the DM display; loads older history at the top"""
+        self.dm_chat_display.vbar.set(first, last)
+        if (float(first) <= 0.0 and self.selected_user and self.dm_has_older
+                and not self._dm_loading_older):
+            self._dm_loading_older = True
+            self.root.after_idle(self.load_older_dm_messages)
+    
+    def load_older_dm_messages(self):
+        """Prepend the page of messages before the oldest one shown"""
+        if not self.selected_user or not self.dm_has_older:
+            self._dm_loading_older = False
+            return
+        
+        query = functools.partial(self.db_worker.get_conversation, self.current_user['user_id'],
+                                  self.selected_user['user_id'], before_id=self.dm_oldest_id,
+                                  limit=self.HISTORY_PAGE_SIZE)
+        self.run_db(self.fetch_page('direct', query, self.selected_user['user_id']),
+                    self.show_older_dm_messages, 'dm_older')
+    
+    def show_older_dm_messages(self, page):
+        """Prepend a page fetched by load_older_dm_messages"""
+        messages = page[0]
+        self.dm_has_older = len(messages) == self.HISTORY_PAGE_SIZE
+        
+        if messages:
+            self.dm_oldest_id = messages[0]['message_id']
+            self.dm_chat_display.config(state='normal')
+            # The mark keeps right gravity, so each message lands after the previous one
+            self.dm_chat_display.mark_set('older_insert', '1.0')
+            self.render_messages(self.dm_chat_display, page, 'direct', 'older_insert')
+            self.dm_chat_display.config(state='disabled')
+            # Keep the message that was at the top before loading in view
+            self.dm_chat_display.yview('older_insert')
+        
+        self._dm_loading_older = False
+    
+    def append_new_dm_messages(self):
+        """Append messages newer than the last one shown"""
+        if not self.selected_user:
+            return
+        if self.dm_newest_id is None:
+            self.load_dm_conversation()
+            return
         
-        # Update streak display after loading conversation
-        self.update_streak_display()
+        query = functools.partial(self.db_worker.get_conversation, self.current_user['user_id'],
+                                  self.selected_user['user_id'], after_id=self.dm_newest_id, limit=None)
+        self.run_db(self.fetch_page('direct', query, self.selected_user['user_id']),
+                    self.show_new_dm_messages, 'dm')
+    
+    def show_new_dm_messages(self, page):
+        """Append messages fetched by append_new_dm_messages"""
+        messages = page[0]
+        if messages:
+            self.dm_newest_id = messages[-1]['message_id']
+            self.dm_chat_display.config(state='normal')
+            self.render_messages(self.dm_chat_display, page, 'direct', tk.END)
+            self.dm_chat_display.config(state='disabled')
+            self.dm_chat_display.see(tk.END)
+    
+    def render_messages(self, display, page, message_type, index):
+        """Insert a page from fetch_page at index
+        
+        The incoming messages are then marked read in one background commit.
+        """
+        messages, reactions, read_ids = page
+        user_id = self.current_user['user_id']
+        if message_type == 'direct':
+            incoming_ids = [msg['message_id'] for msg in messages if msg['sender_id'] != user_id]
+        else:
+            incoming_ids = [msg['message_id'] for msg in messages]
+        
+        for msg in messages:
+            self.render_message(display, msg, message_type, index,
+                                reactions.get(msg['message_id'], []),
+                                msg['message_id'] in read_ids)
+        
+        # Mark as read when viewing
+        if incoming_ids:
+            self.run_db(self.db_worker.mark_read(incoming_ids, user_id, message_type),
+                        lambda marked: self.refresh_unread_badges())
+    
+    def render_message(self, display, msg, message_type, index, reactions, is_read):
+        """Insert one message with its reactions and action links at index"""
+        sender = msg['sender_name']
+        timestamp = msg['sent_at'].strftime('%I:%M %p')
+        text = msg['message_text']
+        image_path = msg.get('image_path')
+        message_id = msg['message_id']
+        is_edited = msg.get('is_edited', 0)
+        is_own = msg['sender_id'] == self.current_user['user_id']
+        image_refs = self._image_refs if message_type == 'direct' else self._group_image_refs
+        
+        if is_own:
+            display.insert(index, f"You [{timestamp}]", 'you')
+        else:
+            display.insert(index, f"{sender} [{timestamp}]", 'them' if message_type == 'direct' else 'member')
+        
+        # Show edited indicator
+        if is_edited:
+            display.insert(index, " (edited)", 'edited')
+        
+        display.insert(index, ":\n")
+        
+        # Display image if present
+        if image_path and os.path.exists(image_path):
+            try:
+                # Load and resize image
+                img = Image.open(image_path)
+                img.thumbnail((300, 300), Image.Resampling.LANCZOS)
+                photo = ImageTk.PhotoImage(img)
+                
+                # Insert image
+                display.insert(index, "\n")
+                display.image_create(index, image=photo)
+                display.insert(index, "\n")
+                
+                # Keep reference to prevent garbage collection
+                image_refs.append(photo)
+            except Exception as e:
+                display.insert(index, f"[Image - Error loading: {str(e)}]\n")
+        
+        # Display text message
+        if text and text != "[Image]":
+            display.insert(index, f"{text}\n")
+        elif not image_path:
+            display.insert(index, "\n")
+        
+        # Show reactions
+        if reactions:
+            reaction_text = " ".join([r['reaction_type'] for r in reactions])
+            display.insert(index, f"  {reaction_text}\n", 'reactions')
+        
+        # Show read receipt for own messages
+        if message_type == 'direct' and is_own:
+            read_indicator = "✓✓" if is_read else "✓"
+            display.insert(index, f"  {read_indicator}\n", 'read_receipt')
+        
+        # Action links, each with a unique tag per message so bindings don't clash
+        def on_react(e, mid=message_id):
+            self.show_reaction_menu(mid, message_type, e.x_root, e.y_root)
+        def on_edit(e, mid=message_id, txt=text):
+            self.edit_message_dialog(mid, txt, message_type)
+        def on_delete(e, mid=message_id):
+            self.delete_message_confirm(mid, message_type)
+        def on_forward(e, mid=message_id):
+            self.forward_message_dialog(mid, message_type)
+        
+        actions = [("[React]", f"react_btn_{message_id}", '#3498db', on_react)]
+        if is_own:
+            actions.append(("[Edit]", f"edit_btn_{message_id}", '#2ecc71', on_edit))
+            actions.append(("[Delete]", f"delete_btn_{message_id}", '#e74c3c', on_delete))
+        actions.append(("[Forward]", f"forward_btn_{message_id}", '#9b59b6', on_forward))
+        
+        display.insert(index, " ", 'actions')
+        for label, tag, color, callback in actions:
+            display.insert(index, " ", 'actions', label, ('actions', tag))
+            display.tag_config(tag, foreground=color, underline=True)
+            display.tag_bind(tag, "<Button-1>", callback)
+        display.insert(index, "\n", 'actions')
+        
+        display.insert(index, "\n")
     
     def load_group_conversation(self):
-        """Load group chat messages"""
+        """Load the latest page of group chat messages
+        
+        Fetched in the background like load_dm_conversation.
+        """
         if not self.selected_group:
             return
         
+        self.cancel_db('group_older')
+        self.group_has_older = False
+        self.group_newest_id = None
+        query = functools.partial(self.db_worker.get_group_messages, self.selected_group['group_id'],
+                                  self.current_user['user_id'], limit=self.HISTORY_PAGE_SIZE)
+        self.run_db(self.fetch_page('group', query), self.show_group_conversation, 'group')
+    
+    def show_group_conversation(self, page):
+        """Replace the group display with a page fetched by load_group_conversation"""
+        messages = page[0]
         self.group_chat_display.config(state='normal')
         self.group_chat_display.delete('1.0', tk.END)
         
@@ -1251,135 +1479,16 @@ class ChatApp:
         else:
             self._group_image_refs = []
         
-        messages = self.db.get_group_messages(self.selected_group['group_id'], 
-                                              self.current_user['user_id'])
+        # Keyset cursors for scroll-back and for appending new messages
+        self.group_has_older = len(messages) == self.HISTORY_PAGE_SIZE
+        self.group_oldest_id = messages[0]['message_id'] if messages else None
+        self.group_newest_id = messages[-1]['message_id'] if messages else None
+        self._group_loading_older = False
         
         if not messages:
             self.group_chat_display.insert(tk.END, "No messages yet in this group\n")
         else:
-            for msg in messages:
-                sender = msg['sender_name']
-                timestamp = msg['sent_at'].strftime('%I:%M %p')
-                text = msg['message_text']
-                image_path = msg.get('image_path')
-                message_id = msg['message_id']
-                is_edited = msg.get('is_edited', 0)
-                is_own = msg['sender_id'] == self.current_user['user_id']
-                
-                if is_own:
-                    self.group_chat_display.insert(tk.END, f"You [{timestamp}]", 'you')
-                else:
-                    self.group_chat_display.insert(tk.END, f"{sender} [{timestamp}]", 'member')
-                
-                # Show edited indicator
-                if is_edited:
-                    self.group_chat_display.insert(tk.END, " (edited)", 'edited')
-                
-                self.group_chat_display.insert(tk.END, ":\n")
-                
-                # Display image if present
-                if image_path and os.path.exists(image_path):
-                    try:
-                        # Load and resize image
-                        img = Image.open(image_path)
-                        img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                        photo = ImageTk.PhotoImage(img)
-                        
-                        # Insert image
-                        self.group_chat_display.insert(tk.END, "\n")
-                        self.group_chat_display.image_create(tk.END, image=photo)
-                        self.group_chat_display.insert(tk.END, "\n")
-                        
-                        # Keep reference to prevent garbage collection
-                        self._group_image_refs.append(photo)
-                    except Exception as e:
-                        self.group_chat_display.insert(tk.END, f"[Image - Error loading: {str(e)}]\n")
-                
-                # Display text message
-                if text and text != "[Image]":
-                    self.group_chat_display.insert(tk.END, f"{text}\n")
-                elif not image_path:
-                    self.group_chat_display.insert(tk.END, "\n")
-                
-                # Show reactions
-                reactions = self.db.get_message_reactions(message_id, 'group')
-                if reactions:
-                    reaction_text = " ".join([r['reaction_type'] for r in reactions])
-                    self.group_chat_display.insert(tk.END, f"  {reaction_text}\n", 'reactions')
-                
-                # Mark as read when viewing
-                self.db.mark_as_read(message_id, self.current_user['user_id'], 'group')
-                
-                # Add action buttons
-                start_pos = self.group_chat_display.index(tk.END + "-1l")
-                if is_own:
-                    self.group_chat_display.insert(tk.END, "  [React] [Edit] [Delete] [Forward]\n", 'actions')
-                    end_pos = self.group_chat_display.index(tk.END + "-1l")
-                    
-                    # Use unique tag names for each message
-                    react_tag = f"react_btn_{message_id}"
-                    edit_tag = f"edit_btn_{message_id}"
-                    delete_tag = f"delete_btn_{message_id}"
-                    forward_tag = f"forward_btn_{message_id}"
-                    
-                    def on_react(e, mid=message_id):
-                        self.show_reaction_menu(mid, 'group', e.x_root, e.y_root)
-                    def on_edit(e, mid=message_id, txt=text):
-                        self.edit_message_dialog(mid, txt, 'group')
-                    def on_delete(e, mid=message_id):
-                        self.delete_message_confirm(mid, 'group')
-                    def on_forward(e, mid=message_id):
-                        self.forward_message_dialog(mid, 'group')
-                    
-                    react_start = self.group_chat_display.search("  [React]", start_pos, end_pos)
-                    react_end = self.group_chat_display.search("]", react_start, end_pos) + "+1c"
-                    self.group_chat_display.tag_add(react_tag, react_start, react_end)
-                    self.group_chat_display.tag_config(react_tag, foreground='#3498db', underline=True)
-                    self.group_chat_display.tag_bind(react_tag, "<Button-1>", on_react)
-                    
-                    edit_start = self.group_chat_display.search("[Edit]", react_end, end_pos)
-                    edit_end = self.group_chat_display.search("]", edit_start, end_pos) + "+1c"
-                    self.group_chat_display.tag_add(edit_tag, edit_start, edit_end)
-                    self.group_chat_display.tag_config(edit_tag, foreground='#2ecc71', underline=True)
-                    self.group_chat_display.tag_bind(edit_tag, "<Button-1>", on_edit)
-                    
-                    delete_start = self.group_chat_display.search("[Delete]", edit_end, end_pos)
-                    delete_end = self.group_chat_display.search("]", delete_start, end_pos) + "+1c"
-                    self.group_chat_display.tag_add(delete_tag, delete_start, delete_end)
-                    self.group_chat_display.tag_config(delete_tag, foreground='#e74c3c', underline=True)
-                    self.group_chat_display.tag_bind(delete_tag, "<Button-1>", on_delete)
-                    
-                    forward_start = self.group_chat_display.search("[Forward]", delete_end, end_pos)
-                    forward_end = self.group_chat_display.search("]", forward_start, end_pos) + "+1c"
-                    self.group_chat_display.tag_add(forward_tag, forward_start, forward_end)
-                    self.group_chat_display.tag_config(forward_tag, foreground='#9b59b6', underline=True)
-                    self.group_chat_display.tag_bind(forward_tag, "<Button-1>", on_forward)
-                else:
-                    self.group_chat_display.insert(tk.END, "  [React] [Forward]\n", 'actions')
-                    end_pos = self.group_chat_display.index(tk.END + "-1l")
-                    
-                    # Use unique tag names for each message
-                    react_tag = f"react_btn_{message_id}"
-                    forward_tag = f"forward_btn_{message_id}"
-                    
-                    def on_react(e, mid=message_id):
-                        self.show_reaction_menu(mid, 'group', e.x_root, e.y_root)
-                    def on_forward(e, mid=message_id):
-                        self.forward_message_dialog(mid, 'group')
-                    
-                    react_start = self.group_chat_display.search("  [React]", start_pos, end_pos)
-                    react_end = self.group_chat_display.search("]", react_start, end_pos) + "+1c"
-                    self.group_chat_display.tag_add(react_tag, react_start, react_end)
-                    self.group_chat_display.tag_config(react_tag, foreground='#3498db', underline=True)
-                    self.group_chat_display.tag_bind(react_tag, "<Button-1>", on_react)
-                    
-                    forward_start = self.group_chat_display.search("[Forward]", react_end, end_pos)
-                    forward_end = self.group_chat_display.search("]", forward_start, end_pos) + "+1c"
-                    self.group_chat_display.tag_add(forward_tag, forward_start, forward_end)
-                    self.group_chat_display.tag_config(forward_tag, foreground='#9b59b6', underline=True)
-                    self.group_chat_display.tag_bind(forward_tag, "<Button-1>", on_forward)
-                
-                self.group_chat_display.insert(tk.END, "\n")
+            self.render_messages(self.group_chat_display, page, 'group', tk.END)
         
         self.group_chat_display.tag_config('you', foreground='#2980b9', font=('Arial', 10, 'bold'))
         self.group_chat_display.tag_config('member', foreground='#8e44ad', font=('Arial', 10, 'bold'))
@@ -1389,6 +1498,62 @@ class ChatApp:
         self.group_chat_display.config(state='disabled')
         self.group_chat_display.see(tk.END)
     
+    def on_group_scroll(self, first, last):
+        """Scrollbar callback for the group display; loads older history at the top"""
+        self.group_chat_display.vbar.set(first, last)
+        if (float(first) <= 0.0 and self.selected_group and self.group_has_older
+                and not self._group_loading_older):
+            self._group_loading_older = True
+            self.root.after_idle(self.load_older_group_messages)
+    
+    def load_older_group_messages(self):
+        """Prepend the page of group messages before the oldest one shown"""
+        if not self.selected_group or not self.group_has_older:
+            self._group_loading_older = False
+            return
+        
+        query = functools.partial(self.db_worker.get_group_messages, self.selected_group['group_id'],
+                                  self.current_user['user_id'], before_id=self.group_oldest_id,
+                                  limit=self.HISTORY_PAGE_SIZE)
+        self.run_db(self.fetch_page('group', query), self.show_older_group_messages, 'group_older')
+    
+    def show_older_group_messages(self, page):
+        """Prepend a page fetched by load_older_group_messages"""
+        messages = page[0]
+        self.group_has_older = len(messages) == self.HISTORY_PAGE_SIZE
+        
+        if messages:
+            self.group_oldest_id = messages[0]['message_id']
+            self.group_chat_display.config(state='normal')
+            self.group_chat_display.mark_set('older_insert', '1.0')
+            self.render_messages(self.group_chat_display, page, 'group', 'older_insert')
+            self.group_chat_display.config(state='disabled')
+            self.group_chat_display.yview('older_insert')
+        
+        self._group_loading_older = False
+    
+    def append_new_group_messages(self):
+        """Append group messages newer than the last one shown"""
+        if not self.selected_group:
+            return
+        if self.group_newest_id is None:
+            self.load_group_conversation()
+            return
+        
+        query = functools.partial(self.db_worker.get_group_messages, self.selected_group['group_id'],
+                                  self.current_user['user_id'], after_id=self.group_newest_id, limit=None)
+        self.run_db(self.fetch_page('group', query), self.show_new_group_messages, 'group')
+    
+    def show_new_group_messages(self, page):
+        """Append group messages fetched by append_new_group_messages"""
+        messages = page[0]
+        if messages:
+            self.group_newest_id = messages[-1]['message_id']
+            self.group_chat_display.config(state='normal')
+            self.render_messages(self.group_chat_display, page, 'group', tk.END)
+            self.group_chat_display.config(state='disabled')
+            self.group_chat_display.see(tk.END)
+    
     def upload_image_dm(self):
         """Upload an image for direct message"""
         if not self.selected_user:
@@ -1409,27 +1574,10 @@ class ChatApp:
             image_path = self.save_image(file_path)
             if image_path:
                 # Send image message
-                success, msg, msg_id, streak_count = self.db.send_message(
-                    self.current_user['user_id'],
-                    self.selected_user['user_id'],
-                    "[Image]",
-                    image_path
-                )
-                
-                if success:
-                    # Mark as read for sender
-                    if msg_id:
-                        self.db.mark_as_read(msg_id, self.current_user['user_id'], 'direct')
-                    self.load_dm_conversation()
-                    
-                    # Update streak display
-                    if streak_count > 0:
-                        self.dm_streak_label.config(text=f"🔥 {streak_count} day streak!")
-                        self.root.after(3000, lambda: self.dm_streak_label.config(text=""))
-                    
-                    self.update_streak_display()
-                else:
-                    messagebox.showerror("Error", msg if msg else "Failed to send image")
+                self.run_db(self.db_worker.send_message(self.current_user['user_id'],
+                                                        self.selected_user['user_id'],
+                                                        "[Image]", image_path),
+                            functools.partial(self.on_dm_sent, error="Failed to send image"))
     
     def upload_image_group(self):
         """Upload an image for group message"""
@@ -1451,17 +1599,10 @@ class ChatApp:
             image_path = self.save_image(file_path)
             if image_path:
                 # Send image message
-                success = self.db.send_group_message(
-                    self.selected_group['group_id'],
-                    self.current_user['user_id'],
-                    "[Image]",
-                    image_path
-                )
-                
-                if success:
-                    self.load_group_conversation()
-                else:
-                    messagebox.showerror("Error", "Failed to send image")
+                self.run_db(self.db_worker.send_group_message(self.selected_group['group_id'],
+                                                              self.current_user['user_id'],
+                                                              "[Image]", image_path),
+                            functools.partial(self.on_group_sent, error="Failed to send image"))
     
     def save_image(self, source_path):
         """Copy image to storage folder and return the relative path"""
@@ -1493,16 +1634,21 @@ class ChatApp:
         if not message_text:
             return
         
-        success, msg, msg_id, streak_count = self.db.send_message(self.current_user['user_id'],
-                                      self.selected_user['user_id'],
-                                      message_text)
+        # Cleared now so a second Enter cannot send it twice; put back on failure
+        self.dm_message_entry.delete(0, tk.END)
+        self.run_db(self.db_worker.send_message(self.current_user['user_id'],
+                                                self.selected_user['user_id'],
+                                                message_text),
+                    functools.partial(self.on_dm_sent, peer_id=self.selected_user['user_id'],
+                                      message_text=message_text))
+    
+    def on_dm_sent(self, result, peer_id=None, message_text=None, error="Failed to send message"):
+        """Show the outcome of a background direct send"""
+        success, msg, msg_id, streak_count = result
         
         if success:
-            # Mark as read for sender
-            if msg_id:
-                self.db.mark_as_read(msg_id, self.current_user['user_id'], 'direct')
-            self.dm_message_entry.delete(0, tk.END)
-            self.load_dm_conversation()
+            self.append_new_dm_messages()
+            self.refresh_panels()
             
             # Update streak display
             if streak_count > 0:
@@ -1513,7 +1659,10 @@ class ChatApp:
             # Update streak display
             self.update_streak_display()
         else:
-            messagebox.showerror("Error", msg if msg else "Failed to send message")
+            messagebox.showerror("Error", msg if msg else error)
+            if (message_text and self.selected_user and self.selected_user['user_id'] == peer_id
+                    and not self.dm_message_entry.get()):
+                self.dm_message_entry.insert(0, message_text)
     
     def send_group_message(self):
         """Send a message to the selected group"""
@@ -1526,15 +1675,24 @@ class ChatApp:
         if not message_text:
             return
         
-        success = self.db.send_group_message(self.selected_group['group_id'],
-                                            self.current_user['user_id'],
-                                            message_text)
-        
+        # Cleared now so a second Enter cannot send it twice; put back on failure
+        self.group_message_entry.delete(0, tk.END)
+        self.run_db(self.db_worker.send_group_message(self.selected_group['group_id'],
+                                                      self.current_user['user_id'],
+                                                      message_text),
+                    functools.partial(self.on_group_sent, group_id=self.selected_group['group_id'],
+                                      message_text=message_text))
+    
+    def on_group_sent(self, success, group_id=None, message_text=None, error="Failed to send message"):
+        """Show the outcome of a background group send"""
         if success:
-            self.group_message_entry.delete(0, tk.END)
-            self.load_group_conversation()
+            self.append_new_group_messages()
+            self.refresh_panels()
         else:
-            messagebox.showerror("Error", "Failed to send message")
+            messagebox.showerror("Error", error)
+            if (message_text and self.selected_group and self.selected_group['group_id'] == group_id
+                    and not self.group_message_entry.get()):
+                self.group_message_entry.insert(0, message_text)
     
     def view_user_profile(self):
         """View selected user's profile"""
@@ -1993,12 +2151,20 @@ class ChatApp:
             
             sender = msg['sender_name']
             timestamp = msg['sent_at'].strftime('%Y-%m-%d %I:%M %p')
-            text = msg['message_text']
             
             tk.Label(msg_frame, text=f"{sender} - {timestamp}", 
                     font=('Arial', 10, 'bold'), bg='white').pack(anchor='w')
-            tk.Label(msg_frame, text=text, font=('Arial', 10), 
-                    bg='white', wraplength=550, justify='left').pack(anchor='w', pady=2)
+            
+            # Snippet with the matched terms highlighted
+            snippet = tk.Text(msg_frame, font=('Arial', 10), bg='white', relief='flat',
+                              wrap='word', height=2, width=70, borderwidth=0)
+            snippet.tag_config('match', background='#f9e79f', font=('Arial', 10, 'bold'))
+            for i, part in enumerate(msg['snippet'].split(HIGHLIGHT_START)):
+                matched, _, rest = part.partition(HIGHLIGHT_END) if i else ('', '', part)
+                snippet.insert(tk.END, matched, 'match')
+                snippet.insert(tk.END, rest)
+            snippet.config(state='disabled')
+            snippet.pack(anchor='w', pady=2, fill='x')
         
         canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
@@ -2106,6 +2272,8 @@ class ChatApp:
         
         tk.Label(forward_window, text="Forward to:", font=('Arial', 14, 'bold'),
                 bg='#ecf0f1').pack(pady=10)
+        tk.Label(forward_window, text="Select any number of friends and groups",
+                font=('Arial', 9), bg='#ecf0f1', fg='#7f8c8d').pack()
         
         # Friends list
         friends_frame = tk.Frame(forward_window, bg='#ecf0f1')
@@ -2114,7 +2282,8 @@ class ChatApp:
         tk.Label(friends_frame, text="Friends:", font=('Arial', 11, 'bold'),
                 bg='#ecf0f1').pack(anchor='w')
         
-        friends_listbox = tk.Listbox(friends_frame, font=('Arial', 11), height=8)
+        friends_listbox = tk.Listbox(friends_frame, font=('Arial', 11), height=8,
+                                     selectmode=tk.MULTIPLE, exportselection=False)
         friends_listbox.pack(fill='both', expand=True, pady=5)
         
         friends = self.db.get_friends(self.current_user['user_id'])
@@ -2126,7 +2295,8 @@ class ChatApp:
         tk.Label(friends_frame, text="Groups:", font=('Arial', 11, 'bold'),
                 bg='#ecf0f1').pack(anchor='w', pady=(10, 0))
         
-        groups_listbox = tk.Listbox(friends_frame, font=('Arial', 11), height=8)
+        groups_listbox = tk.Listbox(friends_frame, font=('Arial', 11), height=8,
+                                    selectmode=tk.MULTIPLE, exportselection=False)
         groups_listbox.pack(fill='both', expand=True, pady=5)
         
         groups = self.db.get_user_groups(self.current_user['user_id'])
@@ -2134,33 +2304,33 @@ class ChatApp:
             groups_listbox.insert(tk.END, f"{group['group_name']} (Group)")
         
         def forward():
-            # Check which list has selection
-            friend_selection = friends_listbox.curselection()
-            group_selection = groups_listbox.curselection()
-            
-            if friend_selection:
-                friend = friends[friend_selection[0]]
-                success, msg = self.db.forward_message(message_id, self.current_user['user_id'],
-                                                      friend['user_id'], message_type, 'direct')
-                if success:
-                    messagebox.showinfo("Success", "Message forwarded!", parent=forward_window)
-                    forward_window.destroy()
-                else:
-                    messagebox.showerror("Error", msg, parent=forward_window)
-            elif group_selection:
-                group = groups[group_selection[0]]
-                success, msg = self.db.forward_message(message_id, self.current_user['user_id'],
-                                                      group['group_id'], message_type, 'group')
-                if success:
-                    messagebox.showinfo("Success", "Message forwarded!", parent=forward_window)
-                    forward_window.destroy()
-                    # Reload group conversation if it's the selected group
-                    if self.selected_group and self.selected_group['group_id'] == group['group_id']:
-                        self.load_group_conversation()
-                else:
-                    messagebox.showerror("Error", msg, parent=forward_window)
-            else:
+            targets = ([('direct', friends[idx]['user_id']) for idx in friends_listbox.curselection()] +
+                       [('group', groups[idx]['group_id']) for idx in groups_listbox.curselection()])
+            if not targets:
                 messagebox.showwarning("Warning", "Please select a friend or group", parent=forward_window)
+                return
+            
+            # One transaction for every selected chat
+            results = self.db.forward_to_many(message_id, self.current_user['user_id'],
+                                              targets, message_type)
+            failures = [msg for success, msg in results.values() if not success]
+            if len(failures) == len(targets):
+                messagebox.showerror("Error", failures[0], parent=forward_window)
+                return
+            
+            summary = f"Message forwarded to {len(targets) - len(failures)} chat(s)!"
+            if failures:
+                summary += f"\n{len(failures)} chat(s) failed: {failures[0]}"
+            messagebox.showinfo("Success", summary, parent=forward_window)
+            forward_window.destroy()
+            
+            # Show the copies in the open chats and move them up the side panels
+            if self.selected_user and ('direct', self.selected_user['user_id']) in targets:
+                self.append_new_dm_messages()
+            if self.selected_group and ('group', self.selected_group['group_id']) in targets:
+                self.append_new_group_messages()
+            self.load_users()
+            self.load_groups()
         
         btn_frame = tk.Frame(forward_window, bg='#ecf0f1')
         btn_frame.pack(pady=10)
@@ -1,28 +1,322 @@
 import sqlite3
 import hashlib
-from datetime import datetime
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Storage-engine tuning profiles. Each one is a coherent set of PRAGMAs
+# applied to every connection Database opens.
+PROFILES = {
+    # Single user on a laptop: WAL so the UI can read while a write is in
+    # flight, NORMAL sync (safe in WAL mode) and a modest cache and mmap.
+    'desktop': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # negative values are KiB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    # Several clients sharing one file: larger cache and mmap for history
+    # scans and a longer busy timeout for writer contention.
+    'server': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 1024 * 1024 * 1024,
+        'cache_size': -256 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+    # Imports and migrations: no fsyncs, biggest cache. A crash mid-load can
+    # lose the last transactions, so only use it for re-runnable jobs.
+    'bulk-load': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'mmap_size': 1024 * 1024 * 1024,
+        'cache_size': -512 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 60000,
+    },
+}
+
+# Readable names for PRAGMAs that SQLite reports back as integers
+PRAGMA_VALUE_NAMES = {
+    'synchronous': {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'},
+    'temp_store': {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'},
+}
+
+# Markers around matched terms in search snippets
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    terms = text.split()
+    return ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+def conversation_key(user1_id, user2_id):
+    """Order-independent key for the pair of users in a direct conversation"""
+    low, high = min(user1_id, user2_id), max(user1_id, user2_id)
+    return (low << 32) | high
+
+# Same key computed in SQL from two user-ID columns
+CONVERSATION_KEY_SQL = '((min({0}, {1}) << 32) | max({0}, {1}))'
+
+# Message times are stored as UTC milliseconds since the Unix epoch
+_EPOCH = datetime(1970, 1, 1)
+
+def _now_ms():
+    """Current time in epoch milliseconds"""
+    return time.time_ns() // 1_000_000
+
+def _ms_to_timestamp(ms):
+    """Epoch milliseconds as a CURRENT_TIMESTAMP-style UTC string"""
+    return (_EPOCH + timedelta(milliseconds=ms)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _chunks(items, size=500):
+    """Split a list of query parameters into IN-list sized chunks"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class _ConnectionLease:
+    """A pooled connection held by one thread.
+    
+    It lives in thread-local storage, so it is collected when its thread
+    exits and the connection goes back to the idle pool.
+    """
+    
+    def __init__(self, conn, idle):
+        self.conn = conn
+        weakref.finalize(self, idle.put, conn)
+
+class Message:
+    """One direct or group message, backed by the row tuple SQLite returned.
+    
+    Read it like the dicts it replaces (msg['message_text'], msg.get(...))
+    or by attribute. sent_at_ms is the send time in UTC epoch milliseconds;
+    sent_at is the same time as a naive UTC datetime, built on first
+    access. sender_name and display_name come from the profile cache.
+    """
+    
+    __slots__ = ('_columns', '_row', '_sent_at', 'sender_name', 'display_name')
+    
+    # Columns added by later schema versions that read as 0 when NULL
+    _ZERO_DEFAULTS = ('is_edited', 'is_deleted')
+    
+    def __init__(self, columns, row):
+        self._columns = columns  # column name -> index, shared by a query's rows
+        self._row = row
+        self._sent_at = None
+        self.sender_name = None
+        self.display_name = None
+    
+    @property
+    def sent_at(self):
+        if self._sent_at is None:
+            self._sent_at = _EPOCH + timedelta(milliseconds=self._row[self._columns['sent_at_ms']])
+        return self._sent_at
+    
+    def __getattr__(self, name):
+        # Only reached for names that are not slots or properties
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+    
+    def __getitem__(self, key):
+        if key in ('sent_at', 'sender_name', 'display_name'):
+            return getattr(self, key)
+        value = self._row[self._columns[key]]
+        if value is None and key in self._ZERO_DEFAULTS:
+            return 0
+        return value
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __contains__(self, key):
+        return key in self._columns or key in ('sender_name', 'display_name')
+    
+    def keys(self):
+        return [*self._columns, 'sender_name', 'display_name']
+    
+    def __repr__(self):
+        return f"Message({dict(self)!r})"
+
+def _fetch_messages(cursor):
+    """Fetch the rest of a message query's result as Message records"""
+    columns = {description[0]: index for index, description in enumerate(cursor.description)}
+    cursor.row_factory = lambda cursor, row: Message(columns, row)
+    return cursor.fetchall()
 
 class Database:
-    def __init__(self, db_name='chat_app.db'):
+    """SQLite access for the chat app.
+    
+    Each thread that uses a Database gets its own connection from a small
+    pool and every method works on its own cursor, so one instance can be
+    shared between the Tk thread and worker threads.
+    
+    An in-memory database lives inside a single connection, so ':memory:'
+    gets a pool of one: only one thread at a time can use it, and others
+    wait for that thread to exit. Use a file for anything multi-threaded.
+    """
+    
+    # Connections per file database
+    POOL_SIZE = 8
+    
+    def __init__(self, db_name='chat_app.db', profile='desktop', pool_size=None):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown database profile: {profile}")
+        if db_name == ':memory:':
+            if pool_size not in (None, 1):
+                raise ValueError("An in-memory database supports only pool_size=1")
+            pool_size = 1
         self.db_name = db_name
-        self.conn = None
-        self.cursor = None
+        self.profile = profile
+        self.pool_size = self.POOL_SIZE if pool_size is None else pool_size
+        self.settings = {}
+        self._local = threading.local()
+        self._idle = queue.LifoQueue()  # connections released by finished threads
+        self._connections = []  # every connection opened, for close()
+        self._pool_lock = threading.Lock()
+        # Social graph cache: user_id -> frozenset of friend / block-related IDs,
+        # group_id -> {member user_id: role}
+        self._friends = {}
+        self._blocks = {}
+        self._group_roles = {}
+        self._profiles = OrderedDict()  # user_id -> profile, least recently used first
+        self._cache_epoch = None  # cache_epoch.epoch the caches were filled under
+        self._cache_checked = 0.0  # monotonic time cache_epoch was last read
+        self._graph_generation = 0
+        self._graph_lock = threading.Lock()
         self.connect()
         self.create_tables()
-        self.create_sample_data()
+        self.has_search_index = self._has_search_index()
     
     def connect(self):
-        """Connect to the database"""
-        self.conn = sqlite3.connect(self.db_name)
-        self.cursor = self.conn.cursor()
-        self.conn.row_factory = sqlite3.Row
-        self.cursor = self.conn.cursor()
+        """Connect to the database and apply the tuning profile"""
+        self.conn.cursor()
+        
+        summary = ", ".join(f"{name}={value}" for name, value in self.settings.items())
+        print(f"Opened {self.db_name} with '{self.profile}' profile: {summary}")
+    
+    @property
+    def conn(self):
+        """The calling thread's connection, checked out of the pool on first use"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            lease = _ConnectionLease(self._acquire_connection(), self._idle)
+            self._local.lease = lease
+        return lease.conn
+    
+    def _acquire_connection(self):
+        """Reuse an idle pooled connection or open a new one"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            if len(self._connections) < self.pool_size:
+                conn = self._open_connection()
+                self._connections.append(conn)
+                return conn
+        
+        # Pool exhausted: wait for a thread to exit and release its connection
+        timeout = PROFILES[self.profile]['busy_timeout'] / 1000
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Database connection pool exhausted")
+    
+    def _open_connection(self):
+        """Open a pooled connection with the profile applied"""
+        # Pooled connections move to another thread once their owner exits
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self.settings = self._apply_profile(conn)
+        return conn
+    
+    def _apply_profile(self, conn):
+        """Apply the profile PRAGMAs to a connection and return the effective values"""
+        settings = {}
+        for name, value in PROFILES[self.profile].items():
+            conn.execute(f'PRAGMA {name} = {value}')
+            # Read back, since SQLite may refuse a setting (e.g. WAL on :memory:)
+            row = conn.execute(f'PRAGMA {name}').fetchone()
+            effective = row[0] if row else None
+            settings[name] = PRAGMA_VALUE_NAMES.get(name, {}).get(effective, effective)
+        return settings
+    
+    # Schema migrations in the order they are applied. PRAGMA user_version
+    # stores the number of the last migration a database file has seen, so
+    # opening an up-to-date file does no schema work at all.
+    MIGRATIONS = [
+        (1, '_migration_001_base_schema'),
+        (2, '_migration_002_indexes'),
+        (3, '_migration_003_read_cursors'),
+        (4, '_migration_004_search_index'),
+        (5, '_migration_005_conversation_keys'),
+        (6, '_migration_006_friend_edges'),
+        (7, '_migration_007_group_member_count'),
+        (8, '_migration_008_sent_at_ms'),
+        (9, '_migration_009_conversation_summaries'),
+        (10, '_migration_010_cache_epoch'),
+    ]
+    
+    @property
+    def schema_version(self):
+        """Latest schema version known to this code"""
+        return self.MIGRATIONS[-1][0]
     
     def create_tables(self):
-        """Create all necessary tables"""
+        """Apply any pending schema migrations in a single transaction"""
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= self.schema_version:
+            return
+        
+        try:
+            # Take the write lock first, then re-read the version in case
+            # another process migrated the file while we were waiting
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('PRAGMA user_version')
+            current_version = cursor.fetchone()[0]
+            
+            for version, migration in self.MIGRATIONS:
+                if version > current_version:
+                    getattr(self, migration)()
+                    current_version = version
+            
+            cursor.execute(f'PRAGMA user_version = {current_version}')
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def _add_missing_columns(self, table, columns):
+        """Add columns that older database files were created without"""
+        cursor = self.conn.cursor()
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row['name'] for row in cursor.fetchall()}
+        for name, definition in columns:
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+    
+    def _migration_001_base_schema(self):
+        """Create the base schema and upgrade files from before versioning"""
+        cursor = self.conn.cursor()
         
-        # Users table (existing)
-        self.cursor.execute('''
+        # Users table
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
@@ -35,8 +329,8 @@ class Database:
             )
         ''')
         
-        # Messages table (existing - for direct messages)
-        self.cursor.execute('''
+        # Messages table (direct messages)
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS messages (
                 message_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 sender_id INTEGER NOT NULL,
@@ -44,37 +338,26 @@ class Database:
                 message_text TEXT NOT NULL,
                 image_path TEXT,
                 sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_edited INTEGER DEFAULT 0,
+                is_deleted INTEGER DEFAULT 0,
+                forwarded_from_id INTEGER,
+                edited_at TIMESTAMP,
                 FOREIGN KEY (sender_id) REFERENCES users(user_id),
                 FOREIGN KEY (receiver_id) REFERENCES users(user_id)
             )
         ''')
         
-        # Add image_path column if it doesn't exist (for existing databases)
-        try:
-            self.cursor.execute('ALTER TABLE messages ADD COLUMN image_path TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+        # Files created before these columns existed
+        self._add_missing_columns('messages', [
+            ('image_path', 'TEXT'),
+            ('is_edited', 'INTEGER DEFAULT 0'),
+            ('is_deleted', 'INTEGER DEFAULT 0'),
+            ('forwarded_from_id', 'INTEGER'),
+            ('edited_at', 'TIMESTAMP'),
+        ])
         
-        # Add edited/deleted columns if they don't exist
-        try:
-            self.cursor.execute('ALTER TABLE messages ADD COLUMN is_edited INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE messages ADD COLUMN is_deleted INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE messages ADD COLUMN forwarded_from_id INTEGER')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE messages ADD COLUMN edited_at TIMESTAMP')
-        except sqlite3.OperationalError:
-            pass
-        
-        # Groups table (NEW)
-        self.cursor.execute('''
+        # Groups table
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS groups (
                 group_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 group_name TEXT NOT NULL,
@@ -86,8 +369,8 @@ class Database:
             )
         ''')
         
-        # Group members table (NEW) - Junction table
-        self.cursor.execute('''
+        # Group members table - Junction table
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS group_members (
                 member_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 group_id INTEGER NOT NULL,
@@ -102,8 +385,8 @@ class Database:
             )
         ''')
         
-        # Group invites table (NEW)
-        self.cursor.execute('''
+        # Group invites table
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS group_invites (
                 invite_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 group_id INTEGER NOT NULL,
@@ -119,8 +402,8 @@ class Database:
             )
         ''')
         
-        # Group messages table (NEW)
-        self.cursor.execute('''
+        # Group messages table
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS group_messages (
                 message_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 group_id INTEGER NOT NULL,
@@ -128,37 +411,25 @@ class Database:
                 message_text TEXT NOT NULL,
                 image_path TEXT,
                 sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_edited INTEGER DEFAULT 0,
+                is_deleted INTEGER DEFAULT 0,
+                forwarded_from_id INTEGER,
+                edited_at TIMESTAMP,
                 FOREIGN KEY (group_id) REFERENCES groups(group_id) ON DELETE CASCADE,
                 FOREIGN KEY (sender_id) REFERENCES users(user_id)
             )
         ''')
         
-        # Add image_path column if it doesn't exist (for existing databases)
-        try:
-            self.cursor.execute('ALTER TABLE group_messages ADD COLUMN image_path TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # Add edited/deleted columns if they don't exist
-        try:
-            self.cursor.execute('ALTER TABLE group_messages ADD COLUMN is_edited INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE group_messages ADD COLUMN is_deleted INTEGER DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE group_messages ADD COLUMN forwarded_from_id INTEGER')
-        except sqlite3.OperationalError:
-            pass
-        try:
-            self.cursor.execute('ALTER TABLE group_messages ADD COLUMN edited_at TIMESTAMP')
-        except sqlite3.OperationalError:
-            pass
+        self._add_missing_columns('group_messages', [
+            ('image_path', 'TEXT'),
+            ('is_edited', 'INTEGER DEFAULT 0'),
+            ('is_deleted', 'INTEGER DEFAULT 0'),
+            ('forwarded_from_id', 'INTEGER'),
+            ('edited_at', 'TIMESTAMP'),
+        ])
         
         # Friend requests table
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS friend_requests (
                 request_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 requester_id INTEGER NOT NULL,
@@ -173,7 +444,7 @@ class Database:
         ''')
         
         # Friendships table
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS friendships (
                 friendship_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user1_id INTEGER NOT NULL,
@@ -186,7 +457,7 @@ class Database:
         ''')
         
         # Blocked users table
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS blocked_users (
                 block_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 blocker_id INTEGER NOT NULL,
@@ -199,7 +470,7 @@ class Database:
         ''')
         
         # Streaks table
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS streaks (
                 streak_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user1_id INTEGER NOT NULL,
@@ -215,7 +486,7 @@ class Database:
         ''')
         
         # Message reactions table
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS message_reactions (
                 reaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 message_id INTEGER NOT NULL,
@@ -229,7 +500,7 @@ class Database:
         ''')
         
         # Read receipts table
-        self.cursor.execute('''
+        cursor.execute('''
             CREATE TABLE IF NOT EXISTS read_receipts (
                 receipt_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 message_id INTEGER NOT NULL,
@@ -241,14 +512,351 @@ class Database:
             )
         ''')
         
-        self.conn.commit()
+        self.create_sample_data()
+    
+    def _migration_002_indexes(self):
+        """Secondary indexes for the lookups the app runs on every screen"""
+        cursor = self.conn.cursor()
+        indexes = [
+            # Direct history, both directions of a pair, in message order
+            'CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages(sender_id, receiver_id, message_id)',
+            # Group history in message order
+            'CREATE INDEX IF NOT EXISTS idx_group_messages_group ON group_messages(group_id, message_id)',
+            # Reactions and read receipts of a message
+            'CREATE INDEX IF NOT EXISTS idx_reactions_message ON message_reactions(message_type, message_id)',
+            'CREATE INDEX IF NOT EXISTS idx_read_receipts_message ON read_receipts(message_type, message_id, user_id)',
+            # Pending requests and invites of a user
+            'CREATE INDEX IF NOT EXISTS idx_friend_requests_recipient ON friend_requests(recipient_id, status)',
+            'CREATE INDEX IF NOT EXISTS idx_group_invites_invitee ON group_invites(invitee_id, status)',
+            # Groups of a user
+            'CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id, group_id)',
+            # Reverse direction of the pair tables (the UNIQUE constraints
+            # already index the forward direction)
+            'CREATE INDEX IF NOT EXISTS idx_friendships_user2 ON friendships(user2_id, user1_id)',
+            'CREATE INDEX IF NOT EXISTS idx_blocked_users_blocked ON blocked_users(blocked_id, blocker_id)',
+            'CREATE INDEX IF NOT EXISTS idx_streaks_user2 ON streaks(user2_id, user1_id)',
+        ]
+        for statement in indexes:
+            cursor.execute(statement)
+    
+    def _migration_003_read_cursors(self):
+        """Replace per-message read receipts with one read cursor per chat"""
+        cursor = self.conn.cursor()
+        
+        # chat_id is the other user for direct chats and the group for group
+        # chats; every message up to last_read_message_id counts as read
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS read_cursors (
+                user_id INTEGER NOT NULL,
+                message_type TEXT NOT NULL CHECK(message_type IN ('direct', 'group')),
+                chat_id INTEGER NOT NULL,
+                last_read_message_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, message_type, chat_id),
+                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        ''')
+        
+        # Each reader's newest receipt in a chat becomes its cursor
+        cursor.execute('''
+            INSERT OR IGNORE INTO read_cursors (user_id, message_type, chat_id, last_read_message_id)
+            SELECT rr.user_id, 'direct',
+                   CASE WHEN m.sender_id = rr.user_id THEN m.receiver_id ELSE m.sender_id END AS chat_id,
+                   MAX(rr.message_id)
+            FROM read_receipts rr
+            JOIN messages m ON m.message_id = rr.message_id
+            WHERE rr.message_type = 'direct'
+            GROUP BY rr.user_id, chat_id
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO read_cursors (user_id, message_type, chat_id, last_read_message_id)
+            SELECT rr.user_id, 'group', gm.group_id, MAX(rr.message_id)
+            FROM read_receipts rr
+            JOIN group_messages gm ON gm.message_id = rr.message_id
+            WHERE rr.message_type = 'group'
+            GROUP BY rr.user_id, gm.group_id
+        ''')
+        
+        cursor.execute('DROP TABLE IF EXISTS read_receipts')
+    
+    def _migration_004_search_index(self):
+        """Full-text index over direct and group message text"""
+        cursor = self.conn.cursor()
+        
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            print("SQLite was built without FTS5; message search will use LIKE")
+            return
+        
+        # External-content tables: the index stores tokens only and reads the
+        # text back from the message tables, kept in sync by the triggers
+        for table in ('messages', 'group_messages'):
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+                    message_text,
+                    content='{table}',
+                    content_rowid='message_id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {table}_fts (rowid, message_text)
+                    VALUES (new.message_id, new.message_text);
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, message_text)
+                    VALUES ('delete', old.message_id, old.message_text);
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF message_text ON {table} BEGIN
+                    INSERT INTO {table}_fts ({table}_fts, rowid, message_text)
+                    VALUES ('delete', old.message_id, old.message_text);
+                    INSERT INTO {table}_fts (rowid, message_text)
+                    VALUES (new.message_id, new.message_text);
+                END
+            ''')
+            
+            # Index the existing history
+            cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+    
+    def _has_search_index(self):
+        """Whether migration 4 created the FTS5 tables in this file"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+        return cursor.fetchone() is not None
+    
+    def _migration_005_conversation_keys(self):
+        """Store a conversation_id pair key on the per-pair tables"""
+        cursor = self.conn.cursor()
+        pair_tables = [
+            ('messages', 'sender_id', 'receiver_id'),
+            ('friendships', 'user1_id', 'user2_id'),
+            ('streaks', 'user1_id', 'user2_id'),
+            ('blocked_users', 'blocker_id', 'blocked_id'),
+        ]
+        for table, first, second in pair_tables:
+            self._add_missing_columns(table, [('conversation_id', 'INTEGER')])
+            cursor.execute(f'''
+                UPDATE {table} SET conversation_id = {CONVERSATION_KEY_SQL.format(first, second)}
+            ''')
+        
+        # Friendships were stored in request order, so the same pair could
+        # appear once per direction; keep the oldest row of each pair
+        cursor.execute('''
+            DELETE FROM friendships
+            WHERE friendship_id NOT IN (
+                SELECT MIN(friendship_id) FROM friendships GROUP BY conversation_id
+            )
+        ''')
+        
+        statements = [
+            # Direct history is one range per conversation
+            'DROP INDEX IF EXISTS idx_messages_pair',
+            'CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, message_id)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_friendships_conversation ON friendships(conversation_id)',
+            'DROP INDEX IF EXISTS idx_streaks_user2',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_streaks_conversation ON streaks(conversation_id)',
+            'CREATE INDEX IF NOT EXISTS idx_blocked_users_conversation ON blocked_users(conversation_id)',
+        ]
+        for statement in statements:
+            cursor.execute(statement)
+    
+    def _migration_006_friend_edges(self):
+        """Friendships stored once per direction, ordered by the friend's username"""
+        cursor = self.conn.cursor()
+        
+        # friendships holds each pair once in request order; friend_edges
+        # holds (user, friend) for both directions so "friends of X" is one
+        # range of the primary key, already sorted by username
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS friend_edges (
+                user_id INTEGER NOT NULL,
+                friend_username TEXT NOT NULL,
+                friend_id INTEGER NOT NULL,
+                PRIMARY KEY (user_id, friend_username, friend_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS friend_edges_insert AFTER INSERT ON friendships BEGIN
+                INSERT OR IGNORE INTO friend_edges (user_id, friend_username, friend_id)
+                SELECT new.user1_id, username, user_id FROM users WHERE user_id = new.user2_id;
+                INSERT OR IGNORE INTO friend_edges (user_id, friend_username, friend_id)
+                SELECT new.user2_id, username, user_id FROM users WHERE user_id = new.user1_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS friend_edges_delete AFTER DELETE ON friendships BEGIN
+                DELETE FROM friend_edges
+                WHERE user_id = old.user1_id AND friend_id = old.user2_id
+                AND friend_username = (SELECT username FROM users WHERE user_id = old.user2_id);
+                DELETE FROM friend_edges
+                WHERE user_id = old.user2_id AND friend_id = old.user1_id
+                AND friend_username = (SELECT username FROM users WHERE user_id = old.user1_id);
+            END
+        ''')
+        # The app never renames users, so this scan is not worth an index
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS friend_edges_rename AFTER UPDATE OF username ON users BEGIN
+                UPDATE friend_edges SET friend_username = new.username WHERE friend_id = new.user_id;
+            END
+        ''')
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO friend_edges (user_id, friend_username, friend_id)
+            SELECT f.user1_id, u.username, u.user_id FROM friendships f JOIN users u ON u.user_id = f.user2_id
+            UNION ALL
+            SELECT f.user2_id, u.username, u.user_id FROM friendships f JOIN users u ON u.user_id = f.user1_id
+        ''')
+        
+        # Reverse lookups on friendships now go through friend_edges
+        cursor.execute('DROP INDEX IF EXISTS idx_friendships_user2')
+    
+    def _migration_007_group_member_count(self):
+        """Keep each group's member count on the groups row"""
+        cursor = self.conn.cursor()
+        self._add_missing_columns('groups', [('member_count', 'INTEGER NOT NULL DEFAULT 0')])
+        cursor.execute('''
+            UPDATE groups
+            SET member_count = (SELECT COUNT(*) FROM group_members WHERE group_id = groups.group_id)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS group_members_count_insert AFTER INSERT ON group_members BEGIN
+                UPDATE groups SET member_count = member_count + 1 WHERE group_id = new.group_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS group_members_count_delete AFTER DELETE ON group_members BEGIN
+                UPDATE groups SET member_count = member_count - 1 WHERE group_id = old.group_id;
+            END
+        ''')
+    
+    def _migration_008_sent_at_ms(self):
+        """Integer epoch-millisecond send times alongside the sent_at text"""
+        cursor = self.conn.cursor()
+        for table in ('messages', 'group_messages'):
+            self._add_missing_columns(table, [('sent_at_ms', 'INTEGER')])
+            cursor.execute(f'''
+                UPDATE {table}
+                SET sent_at_ms = CAST(ROUND((julianday(sent_at) - 2440587.5) * 86400000) AS INTEGER)
+                WHERE sent_at_ms IS NULL
+            ''')
+            # The app sets sent_at_ms itself; this covers rows inserted by
+            # anything else
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_sent_at_ms AFTER INSERT ON {table}
+                WHEN new.sent_at_ms IS NULL BEGIN
+                    UPDATE {table}
+                    SET sent_at_ms = CAST(ROUND((julianday(new.sent_at) - 2440587.5) * 86400000) AS INTEGER)
+                    WHERE message_id = new.message_id;
+                END
+            ''')
+    
+    def _migration_009_conversation_summaries(self):
+        """Per-user summary of every friend chat and group chat"""
+        cursor = self.conn.cursor()
+        
+        # chat_id follows read_cursors: the other user for direct chats and
+        # the group for group chats
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id INTEGER NOT NULL,
+                message_type TEXT NOT NULL CHECK(message_type IN ('direct', 'group')),
+                chat_id INTEGER NOT NULL,
+                last_message_id INTEGER,
+                last_sender_id INTEGER,
+                preview TEXT,
+                last_activity_ms INTEGER NOT NULL,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, message_type, chat_id),
+                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversation_summaries_activity
+            ON conversation_summaries(user_id, message_type, last_activity_ms DESC, chat_id DESC)
+        ''')
+        
+        cursor.execute(self._summary_rebuild_sql('direct', f'''
+            SELECT user_id, friend_id AS chat_id, {CONVERSATION_KEY_SQL.format('user_id', 'friend_id')} AS chat_key
+            FROM friend_edges
+        '''))
+        cursor.execute(self._summary_rebuild_sql('group', '''
+            SELECT user_id, group_id AS chat_id, group_id AS chat_key FROM group_members
+        '''))
+        
+        # Summaries come and go with friendships and group memberships
+        rebuild_friends = self._summary_rebuild_sql('direct', '''
+            SELECT new.user1_id AS user_id, new.user2_id AS chat_id, new.conversation_id AS chat_key
+            UNION ALL
+            SELECT new.user2_id, new.user1_id, new.conversation_id
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS conversation_summaries_friend_insert AFTER INSERT ON friendships BEGIN
+                {rebuild_friends};
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS conversation_summaries_friend_delete AFTER DELETE ON friendships BEGIN
+                DELETE FROM conversation_summaries
+                WHERE message_type = 'direct'
+                AND ((user_id = old.user1_id AND chat_id = old.user2_id)
+                     OR (user_id = old.user2_id AND chat_id = old.user1_id));
+            END
+        ''')
+        rebuild_member = self._summary_rebuild_sql('group', '''
+            SELECT new.user_id AS user_id, new.group_id AS chat_id, new.group_id AS chat_key
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS conversation_summaries_member_insert AFTER INSERT ON group_members BEGIN
+                {rebuild_member};
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS conversation_summaries_member_delete AFTER DELETE ON group_members BEGIN
+                DELETE FROM conversation_summaries
+                WHERE user_id = old.user_id AND message_type = 'group' AND chat_id = old.group_id;
+            END
+        ''')
+    
+    def _migration_010_cache_epoch(self):
+        """Counter bumped by every change to the data Database caches"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_epoch (
+                id INTEGER PRIMARY KEY CHECK(id = 0),
+                epoch INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO cache_epoch (id, epoch) VALUES (0, 0)')
+        
+        # Profile edits and friend, block and membership changes; message
+        # traffic and read marks leave the counter alone
+        events = [('friendships', 'INSERT'), ('friendships', 'DELETE'),
+                  ('blocked_users', 'INSERT'), ('blocked_users', 'DELETE'),
+                  ('group_members', 'INSERT'), ('group_members', 'UPDATE OF role'),
+                  ('group_members', 'DELETE'),
+                  ('users', 'UPDATE OF username, display_name, date_of_birth, country, bio'),
+                  ('users', 'DELETE')]
+        for table, event in events:
+            name = f"cache_epoch_{table}_{event.split()[0].lower()}"
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+                    UPDATE cache_epoch SET epoch = epoch + 1 WHERE id = 0;
+                END
+            ''')
     
     def create_sample_data(self):
-        """Create sample users if they don't exist"""
+        """Create sample users if they don't exist (committed by the caller)"""
+        cursor = self.conn.cursor()
         try:
             # Check if users already exist
-            self.cursor.execute("SELECT COUNT(*) FROM users")
-            if self.cursor.fetchone()[0] == 0:
+            cursor.execute("SELECT COUNT(*) FROM users")
+            if cursor.fetchone()[0] == 0:
                 # Create sample users
                 users = [
                     ('alice', 'password123', 'Alice Johnson'),
@@ -258,12 +866,10 @@ class Database:
                 
                 for username, password, display_name in users:
                     password_hash = hashlib.sha256(password.encode()).hexdigest()
-                    self.cursor.execute('''
+                    cursor.execute('''
                         INSERT INTO users (username, password_hash, display_name)
                         VALUES (?, ?, ?)
                     ''', (username, password_hash, display_name))
-                
-                self.conn.commit()
         except sqlite3.IntegrityError:
             pass
     
@@ -271,28 +877,30 @@ class Database:
     
     def login_user(self, username, password):
         """Verify user credentials"""
+        cursor = self.conn.cursor()
         password_hash = hashlib.sha256(password.encode()).hexdigest()
-        self.cursor.execute('''
+        cursor.execute('''
             SELECT * FROM users 
             WHERE username = ? AND password_hash = ?
         ''', (username, password_hash))
         
-        user = self.cursor.fetchone()
+        user = cursor.fetchone()
         return dict(user) if user else None
     
     def register_user(self, username, password, display_name=None, date_of_birth=None, country=None, bio=None):
         """Register a new user"""
+        cursor = self.conn.cursor()
         try:
             # Check if username already exists
-            self.cursor.execute('SELECT user_id FROM users WHERE username = ?', (username,))
-            if self.cursor.fetchone():
+            cursor.execute('SELECT user_id FROM users WHERE username = ?', (username,))
+            if cursor.fetchone():
                 return False, "Username already exists"
             
             # Hash password
             password_hash = hashlib.sha256(password.encode()).hexdigest()
             
             # Insert new user
-            self.cursor.execute('''
+            cursor.execute('''
                 INSERT INTO users (username, password_hash, display_name, date_of_birth, country, bio)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (username, password_hash, display_name, date_of_birth, country, bio))
@@ -300,105 +908,391 @@ class Database:
             self.conn.commit()
             return True, "Registration successful"
         except Exception as e:
+            self.conn.rollback()
             return False, str(e)
     
+    # Columns cached and returned as a user's profile
+    PROFILE_COLUMNS = 'user_id, username, display_name, date_of_birth, country, bio, created_at'
+    # Most profiles kept in the LRU cache
+    PROFILE_CACHE_SIZE = 2048
+    
     def get_user_by_id(self, user_id):
         """Get user by ID"""
-        self.cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = self.cursor.fetchone()
-        return dict(user) if user else None
+        return self.get_users_by_ids([user_id]).get(user_id)
+    
+    def get_users_by_ids(self, user_ids):
+        """Get profiles for many users at once, as {user_id: profile}
+        
+        Profiles come from an LRU cache; misses are fetched in one query
+        per chunk. Each profile returned is a copy the caller may modify.
+        """
+        self._check_caches()
+        profiles = {}
+        missing = []
+        with self._graph_lock:
+            for user_id in set(user_ids):
+                profile = self._profiles.get(user_id)
+                if profile is None:
+                    missing.append(user_id)
+                else:
+                    self._profiles.move_to_end(user_id)
+                    profiles[user_id] = dict(profile)
+            generation = self._graph_generation
+        
+        if missing:
+            cursor = self.conn.cursor()
+            fetched = {}
+            for chunk in _chunks(missing):
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT {self.PROFILE_COLUMNS} FROM users WHERE user_id IN ({placeholders})
+                ''', chunk)
+                fetched.update((row['user_id'], dict(row)) for row in cursor.fetchall())
+            
+            with self._graph_lock:
+                # Only keep the result if no write raced with the load
+                if generation == self._graph_generation:
+                    self._profiles.update(fetched)
+                    while len(self._profiles) > self.PROFILE_CACHE_SIZE:
+                        self._profiles.popitem(last=False)
+            profiles.update((user_id, dict(profile)) for user_id, profile in fetched.items())
+        
+        return profiles
+    
+    def _attach_sender_names(self, messages):
+        """Fill in sender_name and display_name on Message records from the profile cache"""
+        profiles = self.get_users_by_ids({msg['sender_id'] for msg in messages})
+        for msg in messages:
+            profile = profiles.get(msg['sender_id'])
+            msg.display_name = profile['display_name'] if profile else None
+            msg.sender_name = msg.display_name or (profile['username'] if profile else '')
     
-    def get_all_users(self):
-        """Get all users"""
-        self.cursor.execute('SELECT * FROM users ORDER BY username')
-        return [dict(row) for row in self.cursor.fetchall()]
+    def get_all_users(self, exclude_group_id=None):
+        """Get all users, optionally leaving out the members of a group"""
+        cursor = self.conn.cursor()
+        if exclude_group_id is None:
+            cursor.execute(f'SELECT {self.PROFILE_COLUMNS} FROM users ORDER BY username')
+        else:
+            cursor.execute(f'''
+                SELECT {self.PROFILE_COLUMNS} FROM users
+                WHERE user_id NOT IN (SELECT user_id FROM group_members WHERE group_id = ?)
+                ORDER BY username
+            ''', (exclude_group_id,))
+        return [dict(row) for row in cursor.fetchall()]
     
     def update_profile(self, user_id, display_name, date_of_birth, country, bio):
         """Update user profile"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            epoch = self._begin_graph_write(cursor)
+            cursor.execute('''
                 UPDATE users 
                 SET display_name = ?, date_of_birth = ?, country = ?, bio = ?
                 WHERE user_id = ?
             ''', (display_name, date_of_birth, country, bio, user_id))
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch, profiles=[user_id])
             return True
         except:
+            self.conn.rollback()
             return False
     
+    def _forget_profile(self, user_id):
+        """Drop a user's cached profile after it changed"""
+        with self._graph_lock:
+            self._profiles.pop(user_id, None)
+            self._graph_generation += 1
+    
     def change_password(self, user_id, new_password):
         """Change user password"""
+        cursor = self.conn.cursor()
         try:
             password_hash = hashlib.sha256(new_password.encode()).hexdigest()
-            self.cursor.execute('''
+            cursor.execute('''
                 UPDATE users SET password_hash = ? WHERE user_id = ?
             ''', (password_hash, user_id))
             self.conn.commit()
             return True
         except:
+            self.conn.rollback()
             return False
     
     # ============= EXISTING MESSAGE METHODS =============
     
-    def send_message(self, sender_id, receiver_id, message_text, image_path=None):
-        """Send a direct message"""
+    def send_message(self, sender_id, receiver_id, message_text, image_path=None, forwarded_from_id=None):
+        """Send a direct message
+        
+        The permission checks, insert, streak update, the sender's read mark
+        and both users' conversation summaries run in one transaction with a
+        single commit.
+        """
+        cursor = self.conn.cursor()
         try:
+            # Take the write lock up front so a block or unfriend cannot land
+            # between the checks and the insert
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            
             # Check if users are blocked
             if self.is_blocked(sender_id, receiver_id):
+                self.conn.rollback()
                 return False, "Cannot send message: user is blocked", None, 0
             
             # Check if users are friends
             if not self.are_friends(sender_id, receiver_id):
+                self.conn.rollback()
                 return False, "You must be friends to send messages", None, 0
             
-            self.cursor.execute('''
-                INSERT INTO messages (sender_id, receiver_id, message_text, image_path)
-                VALUES (?, ?, ?, ?)
-            ''', (sender_id, receiver_id, message_text, image_path))
+            sent_at_ms = _now_ms()
+            cursor.execute('''
+                INSERT INTO messages (sender_id, receiver_id, conversation_id, message_text,
+                                      image_path, forwarded_from_id, sent_at_ms)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (sender_id, receiver_id, conversation_key(sender_id, receiver_id),
+                  message_text, image_path, forwarded_from_id, sent_at_ms))
             
-            message_id = self.cursor.lastrowid
+            message_id = cursor.lastrowid
             
             # Update streak
-            streak_count = self.update_streak(sender_id, receiver_id)
+            streak_count = self._upsert_streak(cursor, sender_id, receiver_id)
+            
+            # The sender has read their own message
+            self._advance_read_cursor(cursor, sender_id, 'direct', receiver_id, message_id)
+            self._summarize_direct_message(cursor, sender_id, receiver_id, message_id,
+                                           message_text, sent_at_ms)
             
             self.conn.commit()
             return True, "Message sent", message_id, streak_count
         except Exception as e:
+            self.conn.rollback()
             return False, str(e), None, 0
     
-    def get_conversation(self, user1_id, user2_id):
-        """Get conversation between two users"""
-        self.cursor.execute('''
-            SELECT m.*, u.username as sender_name, u.display_name
+    def send_messages_batch(self, items):
+        """Send many direct messages in one transaction
+        
+        items are (sender_id, receiver_id, message_text[, image_path[,
+        sent_at_ms]]) tuples. Items with a sent_at_ms are stored with that
+        time, e.g. when importing history, and do not count towards today's
+        streak. Permissions are checked once per pair and streaks, read marks
+        and summaries are updated once per conversation. Nothing is sent if
+        any pair may not message. Returns (success, message, message_ids)
+        with the IDs in item order.
+        """
+        items = [tuple(item) + (None,) * (5 - len(item)) for item in items]
+        if not items:
+            return True, "No messages to send", []
+        
+        cursor = self.conn.cursor()
+        try:
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            
+            for sender_id, receiver_id in {(item[0], item[1]) for item in items}:
+                if self.is_blocked(sender_id, receiver_id):
+                    self.conn.rollback()
+                    return False, f"Cannot send message: user {receiver_id} is blocked", []
+                if not self.are_friends(sender_id, receiver_id):
+                    self.conn.rollback()
+                    return False, f"Users {sender_id} and {receiver_id} must be friends to send messages", []
+            
+            message_ids = self._insert_direct_messages(
+                cursor, [(*item[:4], None, item[4]) for item in items])
+            self.conn.commit()
+            return True, f"{len(message_ids)} messages sent", message_ids
+        except Exception as e:
+            self.conn.rollback()
+            return False, str(e), []
+    
+    @staticmethod
+    def _keyset_bounds(before_id, after_id, column='message_id'):
+        """SQL bound, parameters and sort order for one page of history
+        
+        Pages are read newest-first when walking back (or when no cursor is
+        given) and oldest-first when fetching messages after after_id.
+        """
+        if after_id is not None:
+            return f'AND {column} > ?', (after_id,), 'ASC'
+        if before_id is not None:
+            return f'AND {column} < ?', (before_id,), 'DESC'
+        return '', (), 'DESC'
+    
+    def get_conversation(self, user1_id, user2_id, before_id=None, after_id=None, limit=50):
+        """Get a page of the conversation between two users, oldest first
+        
+        By default this is the latest `limit` messages. Pass before_id to
+        page back through older history or after_id to fetch messages newer
+        than the last one shown. limit=None returns the whole range.
+        """
+        cursor = self.conn.cursor()
+        bound, bound_params, order = self._keyset_bounds(before_id, after_id, 'm.message_id')
+        limit = -1 if limit is None else limit
+        
+        # A single range on idx_messages_conversation
+        cursor.execute(f'''
+            SELECT m.*
             FROM messages m
-            JOIN users u ON m.sender_id = u.user_id
-            WHERE ((m.sender_id = ? AND m.receiver_id = ?)
-               OR (m.sender_id = ? AND m.receiver_id = ?))
-            ORDER BY m.sent_at ASC
-        ''', (user1_id, user2_id, user2_id, user1_id))
-        
-        messages = []
-        for row in self.cursor.fetchall():
-            msg = dict(row)
-            msg['sender_name'] = msg['display_name'] or msg['sender_name']
-            msg['sent_at'] = datetime.strptime(msg['sent_at'], '%Y-%m-%d %H:%M:%S')
-            # Set defaults for new fields
-            if 'is_edited' not in msg or msg['is_edited'] is None:
-                msg['is_edited'] = 0
-            if 'is_deleted' not in msg or msg['is_deleted'] is None:
-                msg['is_deleted'] = 0
-            messages.append(msg)
+            WHERE m.conversation_id = ? {bound}
+            ORDER BY m.message_id {order}
+            LIMIT ?
+        ''', (conversation_key(user1_id, user2_id), *bound_params, limit))
         
+        messages = _fetch_messages(cursor)
+        if order == 'DESC':
+            messages.reverse()
+        
+        # Sender names come from the profile cache rather than a join
+        self._attach_sender_names(messages)
         return messages
     
+    # ============= SOCIAL GRAPH CACHE =============
+    
+    # Friend and block sets (per user), member roles (per group) and user
+    # profiles are loaded on first use and patched in place by this
+    # process's writes. Triggers bump cache_epoch on any change to the
+    # tables behind them, from any connection or process, and a new epoch
+    # drops every cache, except the epochs this process's own commits
+    # produce (see _commit_graph_write). Such changes are rare next to
+    # message traffic, which leaves the epoch alone. Outside a transaction
+    # it is read at most once per CACHE_RECHECK seconds, since the read
+    # costs about as much as the lookup it saves. Inside a write
+    # transaction it is read on every check, so permission checks made
+    # under the write lock see every committed block, unfriend or
+    # membership change.
+    CACHE_RECHECK = 0.1
+    
+    def _clear_caches(self):
+        """Forget every cached friend set, block set, group roster and profile"""
+        with self._graph_lock:
+            self._friends.clear()
+            self._blocks.clear()
+            self._group_roles.clear()
+            self._profiles.clear()
+            self._graph_generation += 1
+    
+    def _check_caches(self):
+        """Drop the caches if the data behind them changed since they were filled"""
+        now = time.monotonic()
+        if not self.conn.in_transaction and now - self._cache_checked < self.CACHE_RECHECK:
+            return
+        
+        epoch = self.conn.execute('SELECT epoch FROM cache_epoch WHERE id = 0').fetchone()[0]
+        with self._graph_lock:
+            self._cache_checked = now
+            changed = epoch != self._cache_epoch
+            self._cache_epoch = epoch
+        if changed:
+            self._clear_caches()
+    
+    def _cached_graph_set(self, cache, key, sql, params, build=None):
+        """Return cache[key], loading it with sql on a miss
+        
+        build turns the fetched rows into the cached value; by default it
+        is the frozenset of the first column.
+        """
+        self._check_caches()
+        with self._graph_lock:
+            value = cache.get(key)
+            generation = self._graph_generation
+        if value is not None:
+            return value
+        
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        value = build(rows) if build else frozenset(row[0] for row in rows)
+        with self._graph_lock:
+            # Only keep the result if no write raced with the load
+            if generation == self._graph_generation:
+                cache[key] = value
+        return value
+    
+    def _friend_ids(self, user_id):
+        """Set of user_id's friends"""
+        return self._cached_graph_set(self._friends, user_id, '''
+            SELECT friend_id FROM friend_edges WHERE user_id = ?
+        ''', (user_id,))
+    
+    def _block_ids(self, user_id):
+        """Set of users that user_id has blocked or been blocked by"""
+        return self._cached_graph_set(self._blocks, user_id, '''
+            SELECT blocked_id FROM blocked_users WHERE blocker_id = ?
+            UNION ALL
+            SELECT blocker_id FROM blocked_users WHERE blocked_id = ?
+        ''', (user_id, user_id))
+    
+    def _group_role(self, group_id, user_id):
+        """user_id's role in the group, or None if not a member"""
+        roles = self._cached_graph_set(self._group_roles, group_id, '''
+            SELECT user_id, role FROM group_members WHERE group_id = ?
+        ''', (group_id,), build=lambda rows: {row['user_id']: row['role'] for row in rows})
+        return roles.get(user_id)
+    
+    def _update_group_roles(self, group_id, user_id, role):
+        """Set (or with role=None, remove) a member in the cached roster, if loaded"""
+        with self._graph_lock:
+            roles = self._group_roles.get(group_id)
+            if roles is not None:
+                roles = dict(roles)
+                if role is None:
+                    roles.pop(user_id, None)
+                else:
+                    roles[user_id] = role
+                self._group_roles[group_id] = roles
+            self._graph_generation += 1
+    
+    def _update_social_graph(self, cache, user1_id, user2_id, linked):
+        """Add or remove the pair in both users' cached sets, if loaded"""
+        with self._graph_lock:
+            for user_id, other_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                ids = cache.get(user_id)
+                if ids is not None:
+                    cache[user_id] = ids | {other_id} if linked else ids - {other_id}
+            self._graph_generation += 1
+    
+    def _begin_graph_write(self, cursor):
+        """Take the write lock for a change to the tables behind the caches
+        
+        Returns the cache epoch before the change, for _commit_graph_write.
+        """
+        if not self.conn.in_transaction:
+            cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT epoch FROM cache_epoch WHERE id = 0')
+        return cursor.fetchone()[0]
+    
+    def _commit_graph_write(self, cursor, epoch_before, friends=(), blocks=(), roles=(), profiles=()):
+        """Commit a change begun with _begin_graph_write and patch the caches to match
+        
+        friends and blocks are (user1_id, user2_id, linked) pairs, roles are
+        (group_id, user_id, role) and profiles are user IDs to forget. The
+        write lock was held since epoch_before, so the epoch read here is
+        the one this commit produces. If the caches were current before the
+        change they are current after the patches, and that epoch is adopted
+        so the triggers' bump for our own write does not flush them.
+        """
+        cursor.execute('SELECT epoch FROM cache_epoch WHERE id = 0')
+        epoch = cursor.fetchone()[0]
+        self.conn.commit()
+        
+        for pair in friends:
+            self._update_social_graph(self._friends, *pair)
+        for pair in blocks:
+            self._update_social_graph(self._blocks, *pair)
+        for role in roles:
+            self._update_group_roles(*role)
+        for user_id in profiles:
+            self._forget_profile(user_id)
+        with self._graph_lock:
+            if self._cache_epoch == epoch_before:
+                self._cache_epoch = epoch
+    
     # ============= FRIEND REQUEST METHODS =============
     
     def send_friend_request(self, requester_id, recipient_username):
         """Send a friend request"""
+        cursor = self.conn.cursor()
         try:
             # Get recipient user
-            self.cursor.execute('SELECT user_id FROM users WHERE username = ?', (recipient_username,))
-            recipient = self.cursor.fetchone()
+            cursor.execute('SELECT user_id FROM users WHERE username = ?', (recipient_username,))
+            recipient = cursor.fetchone()
             
             if not recipient:
                 return False, "User not found"
@@ -410,26 +1304,25 @@ class Database:
                 return False, "Cannot send friend request to yourself"
             
             # Check if already friends
-            self.cursor.execute('''
-                SELECT * FROM friendships 
-                WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-            ''', (requester_id, recipient_id, recipient_id, requester_id))
+            cursor.execute('''
+                SELECT * FROM friendships WHERE conversation_id = ?
+            ''', (conversation_key(requester_id, recipient_id),))
             
-            if self.cursor.fetchone():
+            if cursor.fetchone():
                 return False, "Already friends"
             
             # Check if request already exists
-            self.cursor.execute('''
+            cursor.execute('''
                 SELECT * FROM friend_requests 
                 WHERE ((requester_id = ? AND recipient_id = ?) OR (requester_id = ? AND recipient_id = ?))
                 AND status = 'pending'
             ''', (requester_id, recipient_id, recipient_id, requester_id))
             
-            if self.cursor.fetchone():
+            if cursor.fetchone():
                 return False, "Friend request already sent"
             
             # Create friend request
-            self.cursor.execute('''
+            cursor.execute('''
                 INSERT INTO friend_requests (requester_id, recipient_id)
                 VALUES (?, ?)
             ''', (requester_id, recipient_id))
@@ -437,11 +1330,13 @@ class Database:
             self.conn.commit()
             return True, "Friend request sent"
         except Exception as e:
+            self.conn.rollback()
             return False, str(e)
     
     def get_pending_friend_requests(self, user_id):
         """Get all pending friend requests received by a user"""
-        self.cursor.execute('''
+        cursor = self.conn.cursor()
+        cursor.execute('''
             SELECT fr.*, u.username, u.display_name
             FROM friend_requests fr
             JOIN users u ON fr.requester_id = u.user_id
@@ -449,25 +1344,27 @@ class Database:
             ORDER BY fr.requested_at DESC
         ''', (user_id,))
         
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
     
     def respond_to_friend_request(self, request_id, user_id, accept=True):
         """Accept or decline a friend request"""
+        cursor = self.conn.cursor()
         try:
             # Get request details
-            self.cursor.execute('''
+            cursor.execute('''
                 SELECT * FROM friend_requests WHERE request_id = ? AND recipient_id = ?
             ''', (request_id, user_id))
             
-            request = self.cursor.fetchone()
+            request = cursor.fetchone()
             if not request:
                 return False, "Request not found"
             
             request = dict(request)
             status = 'accepted' if accept else 'declined'
+            epoch = self._begin_graph_write(cursor)
             
             # Update request status
-            self.cursor.execute('''
+            cursor.execute('''
                 UPDATE friend_requests 
                 SET status = ?, responded_at = CURRENT_TIMESTAMP
                 WHERE request_id = ?
@@ -475,63 +1372,69 @@ class Database:
             
             # If accepted, create friendship
             if accept:
-                self.cursor.execute('''
-                    INSERT INTO friendships (user1_id, user2_id)
-                    VALUES (?, ?)
-                ''', (request['requester_id'], user_id))
-            
-            self.conn.commit()
+                cursor.execute('''
+                    INSERT INTO friendships (user1_id, user2_id, conversation_id)
+                    VALUES (?, ?, ?)
+                ''', (request['requester_id'], user_id,
+                      conversation_key(request['requester_id'], user_id)))
+            
+            self._commit_graph_write(cursor, epoch,
+                                     friends=[(request['requester_id'], user_id, True)] if accept else ())
             return True, f"Friend request {status}"
         except Exception as e:
+            self.conn.rollback()
             return False, str(e)
     
     def are_friends(self, user1_id, user2_id):
         """Check if two users are friends"""
-        self.cursor.execute('''
-            SELECT * FROM friendships 
-            WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-        ''', (user1_id, user2_id, user2_id, user1_id))
-        
-        return self.cursor.fetchone() is not None
+        return user2_id in self._friend_ids(user1_id)
     
-    def get_friends(self, user_id):
-        """Get all friends of a user"""
-        self.cursor.execute('''
+    def get_friends(self, user_id, after_username=None, limit=None):
+        """Get a user's friends ordered by username
+        
+        Pass limit to page through long friend lists, with after_username
+        set to the last username of the previous page.
+        """
+        cursor = self.conn.cursor()
+        bound = 'AND fe.friend_username > ?' if after_username is not None else ''
+        bound_params = (after_username,) if after_username is not None else ()
+        
+        # One range of friend_edges' primary key, already in username order
+        cursor.execute(f'''
             SELECT u.user_id, u.username, u.display_name, u.date_of_birth, u.country, u.bio
-            FROM friendships f
-            JOIN users u ON (
-                CASE 
-                    WHEN f.user1_id = ? THEN f.user2_id = u.user_id
-                    ELSE f.user1_id = u.user_id
-                END
-            )
-            WHERE f.user1_id = ? OR f.user2_id = ?
-            ORDER BY u.username
-        ''', (user_id, user_id, user_id))
+            FROM friend_edges fe
+            JOIN users u ON u.user_id = fe.friend_id
+            WHERE fe.user_id = ? {bound}
+            ORDER BY fe.friend_username
+            LIMIT ?
+        ''', (user_id, *bound_params, -1 if limit is None else limit))
         
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
     
     def remove_friendship(self, user1_id, user2_id):
         """Remove friendship"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
-                DELETE FROM friendships 
-                WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-            ''', (user1_id, user2_id, user2_id, user1_id))
+            epoch = self._begin_graph_write(cursor)
+            cursor.execute('''
+                DELETE FROM friendships WHERE conversation_id = ?
+            ''', (conversation_key(user1_id, user2_id),))
             
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch, friends=[(user1_id, user2_id, False)])
             return True
         except:
+            self.conn.rollback()
             return False
     
     # ============= BLOCKING METHODS =============
     
     def block_user(self, blocker_id, blocked_username):
         """Block a user"""
+        cursor = self.conn.cursor()
         try:
             # Get blocked user
-            self.cursor.execute('SELECT user_id FROM users WHERE username = ?', (blocked_username,))
-            blocked = self.cursor.fetchone()
+            cursor.execute('SELECT user_id FROM users WHERE username = ?', (blocked_username,))
+            blocked = cursor.fetchone()
             
             if not blocked:
                 return False, "User not found"
@@ -543,53 +1446,58 @@ class Database:
                 return False, "Cannot block yourself"
             
             # Check if already blocked
-            self.cursor.execute('''
+            cursor.execute('''
                 SELECT * FROM blocked_users 
                 WHERE blocker_id = ? AND blocked_id = ?
             ''', (blocker_id, blocked_id))
             
-            if self.cursor.fetchone():
+            if cursor.fetchone():
                 return False, "User already blocked"
             
+            conversation_id = conversation_key(blocker_id, blocked_id)
+            epoch = self._begin_graph_write(cursor)
+            
             # Delete friendship if exists
-            self.cursor.execute('''
-                DELETE FROM friendships 
-                WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-            ''', (blocker_id, blocked_id, blocked_id, blocker_id))
+            cursor.execute('DELETE FROM friendships WHERE conversation_id = ?', (conversation_id,))
             
             # Delete messages between users
-            self.cursor.execute('''
-                DELETE FROM messages 
-                WHERE (sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?)
-            ''', (blocker_id, blocked_id, blocked_id, blocker_id))
+            cursor.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
             
             # Block user
-            self.cursor.execute('''
-                INSERT INTO blocked_users (blocker_id, blocked_id)
-                VALUES (?, ?)
-            ''', (blocker_id, blocked_id))
+            cursor.execute('''
+                INSERT INTO blocked_users (blocker_id, blocked_id, conversation_id)
+                VALUES (?, ?, ?)
+            ''', (blocker_id, blocked_id, conversation_id))
             
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch, friends=[(blocker_id, blocked_id, False)],
+                                     blocks=[(blocker_id, blocked_id, True)])
             return True, "User blocked"
         except Exception as e:
+            self.conn.rollback()
             return False, str(e)
     
     def unblock_user(self, blocker_id, blocked_id):
         """Unblock a user"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            epoch = self._begin_graph_write(cursor)
+            cursor.execute('''
                 DELETE FROM blocked_users 
                 WHERE blocker_id = ? AND blocked_id = ?
             ''', (blocker_id, blocked_id))
             
-            self.conn.commit()
+            # The pair stays blocked if the other user blocked back
+            still_blocked = self._blocked_pair_exists(blocker_id, blocked_id)
+            self._commit_graph_write(cursor, epoch, blocks=[(blocker_id, blocked_id, still_blocked)])
             return True
         except:
+            self.conn.rollback()
             return False
     
     def get_blocked_users(self, user_id):
         """Get all users blocked by this user"""
-        self.cursor.execute('''
+        cursor = self.conn.cursor()
+        cursor.execute('''
             SELECT bu.*, u.username, u.display_name
             FROM blocked_users bu
             JOIN users u ON bu.blocked_id = u.user_id
@@ -597,16 +1505,20 @@ class Database:
             ORDER BY bu.blocked_at DESC
         ''', (user_id,))
         
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
     
     def is_blocked(self, user1_id, user2_id):
         """Check if user1 has blocked user2 or vice versa"""
-        self.cursor.execute('''
-            SELECT * FROM blocked_users 
-            WHERE (blocker_id = ? AND blocked_id = ?) OR (blocker_id = ? AND blocked_id = ?)
-        ''', (user1_id, user2_id, user2_id, user1_id))
+        return user2_id in self._block_ids(user1_id)
+    
+    def _blocked_pair_exists(self, user1_id, user2_id):
+        """Check blocked_users directly for a block in either direction"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT 1 FROM blocked_users WHERE conversation_id = ?
+        ''', (conversation_key(user1_id, user2_id),))
         
-        return self.cursor.fetchone() is not None
+        return cursor.fetchone() is not None
     
     # ============= STREAK METHODS =============
     
@@ -615,148 +1527,99 @@ class Database:
         A streak day counts when both users send at least one message to each other.
         Streak increments each consecutive day where both users messaged.
         """
+        cursor = self.conn.cursor()
         try:
-            from datetime import datetime, timedelta
-            today = datetime.now().date()
-            
-            # Get existing streak
-            self.cursor.execute('''
-                SELECT * FROM streaks 
-                WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-            ''', (sender_id, receiver_id, receiver_id, sender_id))
-            
-            streak = self.cursor.fetchone()
-            
-            # Determine which user is user1 and which is user2 (consistent ordering)
-            if sender_id < receiver_id:
-                user1_id, user2_id = sender_id, receiver_id
-                is_sender_user1 = True
-            else:
-                user1_id, user2_id = receiver_id, sender_id
-                is_sender_user1 = False
-            
-            if streak:
-                streak = dict(streak)
-                last_active = datetime.strptime(streak['last_active_date'], '%Y-%m-%d').date() if streak['last_active_date'] else None
-                
-                # Update the sender's last message date
-                if is_sender_user1:
-                    self.cursor.execute('''
-                        UPDATE streaks 
-                        SET user1_last_message_date = ?, last_active_date = ?
-                        WHERE streak_id = ?
-                    ''', (today, today, streak['streak_id']))
-                else:
-                    self.cursor.execute('''
-                        UPDATE streaks 
-                        SET user2_last_message_date = ?, last_active_date = ?
-                        WHERE streak_id = ?
-                    ''', (today, today, streak['streak_id']))
-                
-                # Get updated status
-                self.cursor.execute('SELECT * FROM streaks WHERE streak_id = ?', (streak['streak_id'],))
-                updated_streak = dict(self.cursor.fetchone())
-                
-                user1_msg_today = updated_streak['user1_last_message_date'] == str(today)
-                user2_msg_today = updated_streak['user2_last_message_date'] == str(today)
-                
-                # Check if streak should reset (more than 1 day since last active)
-                if last_active and (today - last_active).days > 1:
-                    # Reset streak
-                    self.cursor.execute('''
-                        UPDATE streaks 
-                        SET streak_count = 0
-                        WHERE streak_id = ?
-                    ''', (streak['streak_id'],))
-                    new_streak_count = 0
-                # Check if both users messaged today
-                elif user1_msg_today and user2_msg_today:
-                    # Both messaged today - check if we should increment
-                    if last_active:
-                        days_since = (today - last_active).days
-                        if days_since == 0:
-                            # Still today, don't increment
-                            new_streak_count = updated_streak['streak_count']
-                        elif days_since == 1:
-                            # New day, increment streak
-                            self.cursor.execute('''
-                                UPDATE streaks 
-                                SET streak_count = streak_count + 1
-                                WHERE streak_id = ?
-                            ''', (streak['streak_id'],))
-                            new_streak_count = updated_streak['streak_count'] + 1
-                        else:
-                            # More than 1 day gap, reset
-                            self.cursor.execute('''
-                                UPDATE streaks 
-                                SET streak_count = 0
-                                WHERE streak_id = ?
-                            ''', (streak['streak_id'],))
-                            new_streak_count = 0
-                    else:
-                        # First time both messaged
-                        new_streak_count = 0
-                else:
-                    # Not both users messaged today yet
-                    new_streak_count = updated_streak['streak_count']
-            else:
-                # Create new streak
-                user1_msg_date = today if is_sender_user1 else None
-                user2_msg_date = today if not is_sender_user1 else None
-                
-                self.cursor.execute('''
-                    INSERT INTO streaks (user1_id, user2_id, streak_count, last_active_date, 
-                                       user1_last_message_date, user2_last_message_date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user1_id, user2_id, 0, today, user1_msg_date, user2_msg_date))
-                new_streak_count = 0
-            
+            streak_count = self._upsert_streak(cursor, sender_id, receiver_id)
             self.conn.commit()
-            return new_streak_count
+            return streak_count
         except Exception as e:
+            self.conn.rollback()
             print(f"Error updating streak: {e}")
             return 0
     
+    def _upsert_streak(self, cursor, sender_id, receiver_id):
+        """Record today's message from sender_id in one statement; returns the streak count
+        
+        The existing row's values on the right-hand side are the ones from
+        before this message: the streak resets after a gap of more than a
+        day and grows when the last active day was yesterday and both users
+        have now messaged today.
+        """
+        today = datetime.now().date().isoformat()
+        
+        # Determine which user is user1 and which is user2 (consistent ordering)
+        if sender_id < receiver_id:
+            user1_id, user2_id = sender_id, receiver_id
+            user1_msg_date, user2_msg_date = today, None
+        else:
+            user1_id, user2_id = receiver_id, sender_id
+            user1_msg_date, user2_msg_date = None, today
+        
+        cursor.execute('''
+            INSERT INTO streaks (user1_id, user2_id, conversation_id, streak_count, last_active_date,
+                                 user1_last_message_date, user2_last_message_date)
+            VALUES (?, ?, ?, 0, ?, ?, ?)
+            ON CONFLICT(conversation_id) DO UPDATE SET
+                user1_last_message_date = COALESCE(excluded.user1_last_message_date, user1_last_message_date),
+                user2_last_message_date = COALESCE(excluded.user2_last_message_date, user2_last_message_date),
+                last_active_date = excluded.last_active_date,
+                streak_count = CASE
+                    WHEN julianday(excluded.last_active_date) - julianday(last_active_date) > 1 THEN 0
+                    WHEN julianday(excluded.last_active_date) - julianday(last_active_date) = 1
+                         AND COALESCE(excluded.user1_last_message_date, user1_last_message_date) = excluded.last_active_date
+                         AND COALESCE(excluded.user2_last_message_date, user2_last_message_date) = excluded.last_active_date
+                    THEN streak_count + 1
+                    ELSE streak_count
+                END
+            RETURNING streak_count
+        ''', (user1_id, user2_id, conversation_key(user1_id, user2_id), today,
+              user1_msg_date, user2_msg_date))
+        
+        return cursor.fetchone()['streak_count']
+    
     def get_streak(self, user1_id, user2_id):
         """Get streak information between two users"""
-        self.cursor.execute('''
-            SELECT * FROM streaks 
-            WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-        ''', (user1_id, user2_id, user2_id, user1_id))
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT * FROM streaks WHERE conversation_id = ?
+        ''', (conversation_key(user1_id, user2_id),))
         
-        streak = self.cursor.fetchone()
+        streak = cursor.fetchone()
         return dict(streak) if streak else None
     
     # ============= NEW GROUP METHODS =============
     
     def create_group(self, group_name, group_description, created_by, group_avatar='👥'):
         """Create a new group"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            epoch = self._begin_graph_write(cursor)
+            cursor.execute('''
                 INSERT INTO groups (group_name, group_description, group_avatar, created_by)
                 VALUES (?, ?, ?, ?)
             ''', (group_name, group_description, group_avatar, created_by))
             
-            group_id = self.cursor.lastrowid
+            group_id = cursor.lastrowid
             
             # Automatically add creator as admin
-            self.cursor.execute('''
+            cursor.execute('''
                 INSERT INTO group_members (group_id, user_id, role, invited_by)
                 VALUES (?, ?, 'admin', ?)
             ''', (group_id, created_by, created_by))
             
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch, roles=[(group_id, created_by, 'admin')])
             return group_id
         except Exception as e:
+            self.conn.rollback()
             print(f"Error creating group: {e}")
             return None
     
     def get_user_groups(self, user_id):
         """Get all groups a user is a member of"""
-        self.cursor.execute('''
+        cursor = self.conn.cursor()
+        cursor.execute('''
             SELECT g.*, gm.role, gm.joined_at,
-                   u.username as creator_username, u.display_name as creator_name,
-                   (SELECT COUNT(*) FROM group_members WHERE group_id = g.group_id) as member_count
+                   u.username as creator_username, u.display_name as creator_name
             FROM groups g
             JOIN group_members gm ON g.group_id = gm.group_id
             JOIN users u ON g.created_by = u.user_id
@@ -765,7 +1628,7 @@ class Database:
         ''', (user_id,))
         
         groups = []
-        for row in self.cursor.fetchall():
+        for row in cursor.fetchall():
             group = dict(row)
             groups.append(group)
         
@@ -773,20 +1636,21 @@ class Database:
     
     def get_group_by_id(self, group_id):
         """Get group details by ID"""
-        self.cursor.execute('''
-            SELECT g.*, u.username as creator_username, u.display_name as creator_name,
-                   (SELECT COUNT(*) FROM group_members WHERE group_id = g.group_id) as member_count
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT g.*, u.username as creator_username, u.display_name as creator_name
             FROM groups g
             JOIN users u ON g.created_by = u.user_id
             WHERE g.group_id = ?
         ''', (group_id,))
         
-        group = self.cursor.fetchone()
+        group = cursor.fetchone()
         return dict(group) if group else None
     
     def get_group_members(self, group_id):
         """Get all members of a group"""
-        self.cursor.execute('''
+        cursor = self.conn.cursor()
+        cursor.execute('''
             SELECT u.user_id, u.username, u.display_name, gm.role, gm.joined_at
             FROM group_members gm
             JOIN users u ON gm.user_id = u.user_id
@@ -794,44 +1658,66 @@ class Database:
             ORDER BY gm.role DESC, gm.joined_at ASC
         ''', (group_id,))
         
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
     
     def invite_to_group(self, group_id, inviter_id, invitee_id):
-        """Send a group invitation"""
+        """Send a group invitation, reopening a declined or accepted one"""
+        return self.invite_many(group_id, inviter_id, [invitee_id])[invitee_id]
+    
+    def invite_many(self, group_id, inviter_id, invitee_ids):
+        """Send group invitations to many users in one transaction
+        
+        Members come from the roster cache and earlier invitations are found
+        with one query per 500 invitees. Pending invitations are left alone;
+        declined or accepted ones (the user later left) are reopened.
+        Returns {invitee_id: (success, message)}; invite_to_group is the
+        single-invitee case.
+        """
+        invitee_ids = list(dict.fromkeys(invitee_ids))
+        cursor = self.conn.cursor()
         try:
-            # Check if user is already a member
-            self.cursor.execute('''
-                SELECT * FROM group_members 
-                WHERE group_id = ? AND user_id = ?
-            ''', (group_id, invitee_id))
-            
-            if self.cursor.fetchone():
-                return False, "User is already a member"
-            
-            # Check if invitation already exists
-            self.cursor.execute('''
-                SELECT * FROM group_invites 
-                WHERE group_id = ? AND invitee_id = ? AND status = 'pending'
-            ''', (group_id, invitee_id))
-            
-            if self.cursor.fetchone():
-                return False, "Invitation already sent"
-            
-            # Create invitation
-            self.cursor.execute('''
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            
+            results = {invitee_id: (False, "User is already a member")
+                       for invitee_id in invitee_ids if self._group_role(group_id, invitee_id)}
+            candidates = [invitee_id for invitee_id in invitee_ids if invitee_id not in results]
+            
+            for chunk in _chunks(candidates):
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT invitee_id, status FROM group_invites
+                    WHERE group_id = ? AND invitee_id IN ({placeholders})
+                ''', (group_id, *chunk))
+                for row in cursor.fetchall():
+                    if row['status'] == 'pending':
+                        results[row['invitee_id']] = (False, "Invitation already sent")
+            
+            # UNIQUE(group_id, invitee_id) keeps one row per invitee, so an
+            # answered invitation is turned back into a pending one
+            new_invitees = [invitee_id for invitee_id in candidates if invitee_id not in results]
+            cursor.executemany('''
                 INSERT INTO group_invites (group_id, inviter_id, invitee_id)
                 VALUES (?, ?, ?)
-            ''', (group_id, inviter_id, invitee_id))
+                ON CONFLICT(group_id, invitee_id) DO UPDATE SET
+                    status = 'pending',
+                    inviter_id = excluded.inviter_id,
+                    invited_at = CURRENT_TIMESTAMP,
+                    responded_at = NULL
+            ''', [(group_id, inviter_id, invitee_id) for invitee_id in new_invitees])
             
             self.conn.commit()
-            return True, "Invitation sent"
+            results.update((invitee_id, (True, "Invitation sent")) for invitee_id in new_invitees)
+            return {invitee_id: results[invitee_id] for invitee_id in invitee_ids}
         except Exception as e:
+            self.conn.rollback()
             print(f"Error inviting to group: {e}")
-            return False, str(e)
+            return {invitee_id: (False, str(e)) for invitee_id in invitee_ids}
     
     def get_pending_invites(self, user_id):
         """Get all pending group invitations for a user"""
-        self.cursor.execute('''
+        cursor = self.conn.cursor()
+        cursor.execute('''
             SELECT gi.*, g.group_name, g.group_description, g.group_avatar,
                    u.username as inviter_username, u.display_name as inviter_name
             FROM group_invites gi
@@ -841,25 +1727,27 @@ class Database:
             ORDER BY gi.invited_at DESC
         ''', (user_id,))
         
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
     
     def respond_to_invite(self, invite_id, user_id, accept=True):
         """Accept or decline a group invitation"""
+        cursor = self.conn.cursor()
         try:
             # Get invite details
-            self.cursor.execute('''
+            cursor.execute('''
                 SELECT * FROM group_invites WHERE invite_id = ? AND invitee_id = ?
             ''', (invite_id, user_id))
             
-            invite = self.cursor.fetchone()
+            invite = cursor.fetchone()
             if not invite:
                 return False, "Invitation not found"
             
             invite = dict(invite)
             status = 'accepted' if accept else 'declined'
+            epoch = self._begin_graph_write(cursor)
             
             # Update invite status
-            self.cursor.execute('''
+            cursor.execute('''
                 UPDATE group_invites 
                 SET status = ?, responded_at = CURRENT_TIMESTAMP
                 WHERE invite_id = ?
@@ -867,239 +1755,718 @@ class Database:
             
             # If accepted, add user to group
             if accept:
-                self.cursor.execute('''
+                cursor.execute('''
                     INSERT INTO group_members (group_id, user_id, role, invited_by)
                     VALUES (?, ?, 'member', ?)
                 ''', (invite['group_id'], user_id, invite['inviter_id']))
             
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch,
+                                     roles=[(invite['group_id'], user_id, 'member')] if accept else ())
             return True, f"Invitation {status}"
         except Exception as e:
+            self.conn.rollback()
             print(f"Error responding to invite: {e}")
             return False, str(e)
     
     def send_group_message(self, group_id, sender_id, message_text, image_path=None):
         """Send a message to a group"""
+        return self._send_group_message(group_id, sender_id, message_text, image_path) is not None
+    
+    def _send_group_message(self, group_id, sender_id, message_text, image_path=None,
+                            forwarded_from_id=None):
+        """Send a message to a group and return its ID (None on failure)
+        
+        The insert, the sender's read mark and every member's conversation
+        summary are committed together.
+        """
+        cursor = self.conn.cursor()
         try:
-            # Verify user is a member
-            self.cursor.execute('''
-                SELECT * FROM group_members 
-                WHERE group_id = ? AND user_id = ?
-            ''', (group_id, sender_id))
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
             
-            if not self.cursor.fetchone():
-                return False
+            # Verify user is a member
+            if not self._group_role(group_id, sender_id):
+                self.conn.rollback()
+                return None
             
             # Send message
-            self.cursor.execute('''
-                INSERT INTO group_messages (group_id, sender_id, message_text, image_path)
-                VALUES (?, ?, ?, ?)
-            ''', (group_id, sender_id, message_text, image_path))
+            sent_at_ms = _now_ms()
+            cursor.execute('''
+                INSERT INTO group_messages (group_id, sender_id, message_text, image_path,
+                                            forwarded_from_id, sent_at_ms)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (group_id, sender_id, message_text, image_path, forwarded_from_id, sent_at_ms))
             
+            message_id = cursor.lastrowid
+            self._advance_read_cursor(cursor, sender_id, 'group', group_id, message_id)
+            self._summarize_group_message(cursor, group_id, sender_id, message_id,
+                                          message_text, sent_at_ms)
             self.conn.commit()
-            return True
+            return message_id
         except Exception as e:
+            self.conn.rollback()
             print(f"Error sending group message: {e}")
-            return False
+            return None
     
-    def get_group_messages(self, group_id, user_id):
-        """Get all messages from a group (if user is a member)"""
-        # Verify user is a member
-        self.cursor.execute('''
-            SELECT * FROM group_members 
-            WHERE group_id = ? AND user_id = ?
-        ''', (group_id, user_id))
+    def _insert_direct_messages(self, cursor, rows):
+        """Insert already-permitted direct messages and update what depends on them
+        
+        rows are (sender_id, receiver_id, message_text, image_path,
+        forwarded_from_id, sent_at_ms) tuples, where a sent_at_ms of None
+        means now. Streaks, senders' read marks and summaries are updated
+        once per conversation; backdated rows are left out of the streaks.
+        Returns the new IDs in row order; the caller holds the write
+        transaction and commits.
+        """
+        now_ms = _now_ms()
+        rows = [(*row[:5], now_ms if row[5] is None else row[5], row[5] is not None) for row in rows]
+        cursor.executemany('''
+            INSERT INTO messages (sender_id, receiver_id, conversation_id, message_text,
+                                  image_path, forwarded_from_id, sent_at_ms, sent_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(sender_id, receiver_id, conversation_key(sender_id, receiver_id),
+               message_text, image_path, forwarded_from_id, sent_at_ms, _ms_to_timestamp(sent_at_ms))
+              for sender_id, receiver_id, message_text, image_path, forwarded_from_id, sent_at_ms, _ in rows])
+        message_ids = self._inserted_ids(cursor, len(rows))
+        
+        conversations = {}
+        for message_id, (sender_id, receiver_id, message_text, _, _, sent_at_ms, backdated) in zip(message_ids, rows):
+            conversation = conversations.setdefault(conversation_key(sender_id, receiver_id), ([], set()))
+            conversation[0].append((message_id, sender_id, receiver_id, message_text, sent_at_ms))
+            if not backdated:
+                conversation[1].add(sender_id)
+        
+        for messages, streak_senders in conversations.values():
+            _, sender_id, receiver_id, _, _ = messages[0]
+            for sender in streak_senders:
+                self._upsert_streak(cursor, sender, receiver_id if sender == sender_id else sender_id)
+            self._summarize_batch(cursor, 'direct', messages,
+                                  self._chat_participants(cursor, 'direct', receiver_id, sender_id))
+        return message_ids
+    
+    @staticmethod
+    def _inserted_ids(cursor, count):
+        """IDs of the last `count` rows inserted by executemany
+        
+        message_id is AUTOINCREMENT and the caller holds the write lock, so
+        the rows got consecutive IDs ending at last_insert_rowid().
+        """
+        cursor.execute('SELECT last_insert_rowid()')
+        first_id = cursor.fetchone()[0] - count + 1
+        return list(range(first_id, first_id + count))
+    
+    def send_group_messages_batch(self, group_id, items):
+        """Send many messages to a group in one transaction
         
-        if not self.cursor.fetchone():
+        items are (sender_id, message_text[, image_path[, sent_at_ms]])
+        tuples; items with a sent_at_ms are stored with that time. Membership
+        is checked once per sender and the members' summaries are updated
+        once for the whole batch. Returns the new message IDs in item order,
+        or None if nothing was sent.
+        """
+        items = [tuple(item) + (None,) * (4 - len(item)) for item in items]
+        if not items:
             return []
         
-        # Get messages
-        self.cursor.execute('''
-            SELECT gm.*, u.username as sender_name, u.display_name
+        cursor = self.conn.cursor()
+        try:
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            
+            if not all(self._group_role(group_id, sender_id) for sender_id in {item[0] for item in items}):
+                self.conn.rollback()
+                return None
+            
+            message_ids = self._insert_group_messages(
+                cursor, [(group_id, *item[:3], None, item[3]) for item in items])
+            self.conn.commit()
+            return message_ids
+        except Exception as e:
+            self.conn.rollback()
+            print(f"Error sending group messages: {e}")
+            return None
+    
+    def _insert_group_messages(self, cursor, rows):
+        """Insert already-permitted group messages and update what depends on them
+        
+        rows are (group_id, sender_id, message_text, image_path,
+        forwarded_from_id, sent_at_ms) tuples and may span groups, where a
+        sent_at_ms of None means now. Summaries are updated once per group.
+        Returns the new IDs in row order; the caller holds the write
+        transaction and commits.
+        """
+        now_ms = _now_ms()
+        rows = [(*row[:5], now_ms if row[5] is None else row[5]) for row in rows]
+        cursor.executemany('''
+            INSERT INTO group_messages (group_id, sender_id, message_text, image_path,
+                                        forwarded_from_id, sent_at_ms, sent_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(*row, _ms_to_timestamp(row[5])) for row in rows])
+        message_ids = self._inserted_ids(cursor, len(rows))
+        
+        groups = {}
+        for message_id, (group_id, sender_id, message_text, _, _, sent_at_ms) in zip(message_ids, rows):
+            groups.setdefault(group_id, []).append(
+                (message_id, sender_id, group_id, message_text, sent_at_ms))
+        
+        for group_id, messages in groups.items():
+            self._summarize_batch(cursor, 'group', messages,
+                                  self._chat_participants(cursor, 'group', group_id))
+        return message_ids
+    
+    def get_group_messages(self, group_id, user_id, before_id=None, after_id=None, limit=50):
+        """Get a page of a group's messages, oldest first (if user is a member)
+        
+        Paging works like get_conversation: the latest `limit` messages by
+        default, before_id for older history, after_id for newer messages.
+        """
+        cursor = self.conn.cursor()
+        # Verify user is a member
+        if not self._group_role(group_id, user_id):
+            return []
+        
+        # Get one page of messages, a range on idx_group_messages_group
+        bound, bound_params, order = self._keyset_bounds(before_id, after_id, 'gm.message_id')
+        cursor.execute(f'''
+            SELECT gm.*
             FROM group_messages gm
-            JOIN users u ON gm.sender_id = u.user_id
-            WHERE gm.group_id = ?
-            ORDER BY gm.sent_at ASC
-        ''', (group_id,))
+            WHERE gm.group_id = ? {bound}
+            ORDER BY gm.message_id {order}
+            LIMIT ?
+        ''', (group_id, *bound_params, -1 if limit is None else limit))
         
-        messages = []
-        for row in self.cursor.fetchall():
-            msg = dict(row)
-            msg['sender_name'] = msg['display_name'] or msg['sender_name']
-            msg['sent_at'] = datetime.strptime(msg['sent_at'], '%Y-%m-%d %H:%M:%S')
-            # Set defaults for new fields
-            if 'is_edited' not in msg or msg['is_edited'] is None:
-                msg['is_edited'] = 0
-            if 'is_deleted' not in msg or msg['is_deleted'] is None:
-                msg['is_deleted'] = 0
-            messages.append(msg)
+        messages = _fetch_messages(cursor)
+        if order == 'DESC':
+            messages.reverse()
         
+        # Sender names come from the profile cache rather than a join
+        self._attach_sender_names(messages)
         return messages
     
     def leave_group(self, group_id, user_id):
         """Leave a group"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            epoch = self._begin_graph_write(cursor)
+            cursor.execute('''
                 DELETE FROM group_members 
                 WHERE group_id = ? AND user_id = ?
             ''', (group_id, user_id))
             
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch, roles=[(group_id, user_id, None)])
             return True
         except:
+            self.conn.rollback()
             return False
     
     def remove_member(self, group_id, admin_id, member_id):
         """Remove a member from group (admin only)"""
+        cursor = self.conn.cursor()
         try:
             # Verify admin status
-            self.cursor.execute('''
-                SELECT role FROM group_members 
-                WHERE group_id = ? AND user_id = ?
-            ''', (group_id, admin_id))
-            
-            result = self.cursor.fetchone()
-            if not result or result['role'] != 'admin':
+            if self._group_role(group_id, admin_id) != 'admin':
                 return False, "Only admins can remove members"
             
             # Remove member
-            self.cursor.execute('''
+            epoch = self._begin_graph_write(cursor)
+            cursor.execute('''
                 DELETE FROM group_members 
                 WHERE group_id = ? AND user_id = ?
             ''', (group_id, member_id))
             
-            self.conn.commit()
+            self._commit_graph_write(cursor, epoch, roles=[(group_id, member_id, None)])
             return True, "Member removed"
         except Exception as e:
+            self.conn.rollback()
             return False, str(e)
     
     # ============= MESSAGE REACTIONS =============
     
     def add_reaction(self, message_id, user_id, reaction_type, message_type='direct'):
         """Add a reaction to a message"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            cursor.execute('''
                 INSERT OR REPLACE INTO message_reactions (message_id, user_id, reaction_type, message_type)
                 VALUES (?, ?, ?, ?)
             ''', (message_id, user_id, reaction_type, message_type))
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             print(f"Error adding reaction: {e}")
             return False
     
     def remove_reaction(self, message_id, user_id, message_type='direct'):
         """Remove a reaction from a message"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            cursor.execute('''
                 DELETE FROM message_reactions 
                 WHERE message_id = ? AND user_id = ? AND message_type = ?
             ''', (message_id, user_id, message_type))
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             return False
     
     def get_message_reactions(self, message_id, message_type='direct'):
         """Get all reactions for a message"""
-        self.cursor.execute('''
+        cursor = self.conn.cursor()
+        cursor.execute('''
             SELECT mr.*, u.username, u.display_name
             FROM message_reactions mr
             JOIN users u ON mr.user_id = u.user_id
             WHERE mr.message_id = ? AND mr.message_type = ?
         ''', (message_id, message_type))
-        return [dict(row) for row in self.cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def get_reactions_for_messages(self, message_ids, message_type='direct'):
+        """Get the reactions of many messages at once
+        
+        Returns a dict of message_id -> list of reactions (same rows as
+        get_message_reactions); messages without reactions are left out.
+        """
+        cursor = self.conn.cursor()
+        reactions = {}
+        for chunk in _chunks(list(message_ids)):
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT mr.*, u.username, u.display_name
+                FROM message_reactions mr
+                JOIN users u ON mr.user_id = u.user_id
+                WHERE mr.message_type = ? AND mr.message_id IN ({placeholders})
+                ORDER BY mr.reaction_id
+            ''', (message_type, *chunk))
+            for row in cursor.fetchall():
+                reactions.setdefault(row['message_id'], []).append(dict(row))
+        return reactions
+    
+    # ============= CONVERSATION SUMMARIES =============
+    
+    # One conversation_summaries row per friend chat and group chat a user
+    # has, holding the latest message and the user's unread count, so the
+    # side panels are a single range of idx_conversation_summaries_activity.
+    # Sends, edits, deletes and reads keep the rows current; triggers on
+    # friendships and group_members create and remove them.
+    
+    # Characters of message text kept as a summary preview
+    PREVIEW_LENGTH = 80
+    
+    @staticmethod
+    def _summary_source(message_type):
+        """Message table and the column that identifies a chat in it"""
+        if message_type == 'direct':
+            return 'messages', 'conversation_id'
+        return 'group_messages', 'group_id'
+    
+    def _summary_rebuild_sql(self, message_type, source_sql):
+        """SQL recomputing summaries from scratch
+        
+        source_sql selects user_id, chat_id and chat_key (the value of the
+        chat column in the message table) for each summary to rebuild.
+        """
+        table, column = self._summary_source(message_type)
+        return f'''
+            INSERT OR REPLACE INTO conversation_summaries
+                (user_id, message_type, chat_id, last_message_id, last_sender_id,
+                 preview, last_activity_ms, unread_count)
+            SELECT s.user_id, '{message_type}', s.chat_id, m.message_id, m.sender_id,
+                   substr(m.message_text, 1, {self.PREVIEW_LENGTH}),
+                   COALESCE(m.sent_at_ms, cs.last_activity_ms,
+                            CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
+                   (SELECT COUNT(*) FROM {table} unread
+                    WHERE unread.{column} = s.chat_key
+                    AND unread.message_id > COALESCE(rc.last_read_message_id, 0)
+                    AND unread.sender_id != s.user_id)
+            FROM ({source_sql}) s
+            LEFT JOIN {table} m
+              ON m.message_id = (SELECT MAX(message_id) FROM {table} WHERE {column} = s.chat_key)
+            LEFT JOIN read_cursors rc
+              ON rc.user_id = s.user_id AND rc.message_type = '{message_type}' AND rc.chat_id = s.chat_id
+            LEFT JOIN conversation_summaries cs
+              ON cs.user_id = s.user_id AND cs.message_type = '{message_type}' AND cs.chat_id = s.chat_id
+        '''
+    
+    def _chat_participants(self, cursor, message_type, chat_id, user_id=None):
+        """(user_id, chat_id) of every summary of a chat
+        
+        For direct chats chat_id is one user and user_id the other.
+        """
+        if message_type == 'direct':
+            return [(user_id, chat_id), (chat_id, user_id)]
+        cursor.execute('SELECT user_id FROM group_members WHERE group_id = ?', (chat_id,))
+        return [(row['user_id'], chat_id) for row in cursor.fetchall()]
+    
+    def _message_participants(self, cursor, message_type, message):
+        """(user_id, chat_id) of every summary of a message's chat"""
+        if message_type == 'direct':
+            return self._chat_participants(cursor, 'direct', message['receiver_id'], message['sender_id'])
+        return self._chat_participants(cursor, 'group', message['group_id'])
+    
+    def _rebuild_summaries(self, cursor, message_type, participants):
+        """Recompute the existing summaries among the given (user_id, chat_id) pairs"""
+        if message_type == 'direct':
+            rows = [(conversation_key(user_id, chat_id), user_id, chat_id) for user_id, chat_id in participants]
+        else:
+            rows = [(chat_id, user_id, chat_id) for user_id, chat_id in participants]
+        cursor.executemany(self._summary_rebuild_sql(message_type, f'''
+            SELECT user_id, chat_id, ? AS chat_key FROM conversation_summaries
+            WHERE user_id = ? AND message_type = '{message_type}' AND chat_id = ?
+        '''), rows)
+    
+    def _summarize_deleted_message(self, cursor, message_type, message):
+        """Take a deleted message out of its chat's summaries without recounting
+        
+        Participants who had not read it lose one unread message, and only
+        the rows that showed it as the latest move to the message before it.
+        """
+        table, column = self._summary_source(message_type)
+        message_id, sender_id = message['message_id'], message['sender_id']
+        participants = self._message_participants(cursor, message_type, message)
+        
+        cursor.executemany('''
+            UPDATE conversation_summaries
+            SET unread_count = unread_count - 1
+            WHERE user_id = ? AND message_type = ? AND chat_id = ? AND unread_count > 0
+            AND ? > COALESCE((SELECT last_read_message_id FROM read_cursors
+                              WHERE user_id = ? AND message_type = ? AND chat_id = ?), 0)
+        ''', [(user_id, message_type, chat_id, message_id, user_id, message_type, chat_id)
+              for user_id, chat_id in participants if user_id != sender_id])
+        
+        cursor.execute(f'''
+            SELECT message_id, sender_id, message_text, sent_at_ms FROM {table}
+            WHERE {column} = ? ORDER BY message_id DESC LIMIT 1
+        ''', (message[column],))
+        latest = cursor.fetchone() or (None, None, None, None)
+        cursor.executemany(f'''
+            UPDATE conversation_summaries
+            SET last_message_id = ?, last_sender_id = ?, preview = substr(?, 1, {self.PREVIEW_LENGTH}),
+                last_activity_ms = COALESCE(?, last_activity_ms)
+            WHERE user_id = ? AND message_type = ? AND chat_id = ? AND last_message_id = ?
+        ''', [(*latest, user_id, message_type, chat_id, message_id) for user_id, chat_id in participants])
+    
+    # Applied when a new message becomes a chat's latest: the sender has
+    # read up to it, everyone else has one more unread message
+    _SUMMARY_NEW_MESSAGE = '''
+        ON CONFLICT(user_id, message_type, chat_id) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_sender_id = excluded.last_sender_id,
+            preview = excluded.preview,
+            last_activity_ms = excluded.last_activity_ms,
+            unread_count = CASE WHEN excluded.last_sender_id = conversation_summaries.user_id
+                                THEN 0 ELSE unread_count + 1 END
+    '''
+    
+    def _summarize_direct_message(self, cursor, sender_id, receiver_id, message_id, message_text, sent_at_ms):
+        """Record a new direct message in both users' summaries
+        
+        Only existing rows are updated: the friendship triggers own their
+        lifetime, so a send racing an unfriend or block cannot bring back
+        the row that removed the ex-friend from the panel.
+        """
+        cursor.executemany(f'''
+            UPDATE conversation_summaries
+            SET last_message_id = ?, last_sender_id = ?,
+                preview = substr(?, 1, {self.PREVIEW_LENGTH}), last_activity_ms = ?,
+                unread_count = CASE WHEN user_id = ? THEN 0 ELSE unread_count + 1 END
+            WHERE user_id = ? AND message_type = 'direct' AND chat_id = ?
+        ''', [(message_id, sender_id, message_text, sent_at_ms, sender_id, user_id, chat_id)
+              for user_id, chat_id in ((sender_id, receiver_id), (receiver_id, sender_id))])
+    
+    def _summarize_group_message(self, cursor, group_id, sender_id, message_id, message_text, sent_at_ms):
+        """Record a new group message in every member's summary, in one statement"""
+        cursor.execute(f'''
+            INSERT INTO conversation_summaries
+                (user_id, message_type, chat_id, last_message_id, last_sender_id,
+                 preview, last_activity_ms, unread_count)
+            SELECT user_id, 'group', group_id, ?, ?, substr(?, 1, {self.PREVIEW_LENGTH}), ?, user_id != ?
+            FROM group_members
+            WHERE group_id = ?
+            {self._SUMMARY_NEW_MESSAGE}
+        ''', (message_id, sender_id, message_text, sent_at_ms, sender_id, group_id))
+    
+    def _summarize_batch(self, cursor, message_type, messages, participants):
+        """Record a batch of new messages in one chat in every participant's summary
+        
+        messages are (message_id, sender_id, recipient, message_text,
+        sent_at_ms) tuples in ID order, where recipient is the receiver of a
+        direct message and the group of a group message. A backdated batch
+        never moves last_activity_ms back.
+        """
+        last_id, last_sender_id, _, last_text, _ = messages[-1]
+        sent_at_ms = max(message[4] for message in messages)
+        # Each sender has read up to their own last message in the batch
+        last_own = {sender_id: message_id for message_id, sender_id, _, _, _ in messages}
+        
+        # Rows are only updated, never created, as in _summarize_direct_message
+        cursor.executemany(f'''
+            UPDATE conversation_summaries
+            SET last_message_id = ?, last_sender_id = ?,
+                preview = substr(?, 1, {self.PREVIEW_LENGTH}),
+                last_activity_ms = MAX(last_activity_ms, ?),
+                unread_count = unread_count + ?
+            WHERE user_id = ? AND message_type = ? AND chat_id = ?
+        ''', [(last_id, last_sender_id, last_text, sent_at_ms,
+               sum(1 for message in messages if message[1] != user_id), user_id, message_type, chat_id)
+              for user_id, chat_id in participants if user_id not in last_own])
+        
+        for user_id, chat_id in participants:
+            if user_id in last_own:
+                self._advance_read_cursor(cursor, user_id, message_type, chat_id, last_own[user_id])
+                cursor.execute(f'''
+                    UPDATE conversation_summaries
+                    SET last_message_id = ?, last_sender_id = ?,
+                        preview = substr(?, 1, {self.PREVIEW_LENGTH}),
+                        last_activity_ms = MAX(last_activity_ms, ?)
+                    WHERE user_id = ? AND message_type = ? AND chat_id = ?
+                ''', (last_id, last_sender_id, last_text, sent_at_ms, user_id, message_type, chat_id))
+                self._recount_unread(cursor, user_id, message_type, chat_id, last_own[user_id])
+    
+    def _recount_unread(self, cursor, user_id, message_type, chat_id, last_read_message_id):
+        """Recompute one summary's unread count after its read cursor moved"""
+        table, column = self._summary_source(message_type)
+        chat_key = conversation_key(user_id, chat_id) if message_type == 'direct' else chat_id
+        # Reading up to the latest message, the usual case, needs no count
+        cursor.execute(f'''
+            UPDATE conversation_summaries
+            SET unread_count = CASE
+                WHEN COALESCE(last_message_id, 0) <= ? THEN 0
+                ELSE (SELECT COUNT(*) FROM {table}
+                      WHERE {column} = ? AND message_id > ? AND sender_id != ?)
+            END
+            WHERE user_id = ? AND message_type = ? AND chat_id = ?
+        ''', (last_read_message_id, chat_key, last_read_message_id, user_id,
+              user_id, message_type, chat_id))
+    
+    def _get_summaries(self, user_id, message_type, before=None, limit=None):
+        """A page of a user's summaries, most recent activity first"""
+        cursor = self.conn.cursor()
+        bound = 'AND (last_activity_ms, chat_id) < (?, ?)' if before else ''
+        cursor.execute(f'''
+            SELECT chat_id, last_message_id, last_sender_id, preview, last_activity_ms, unread_count
+            FROM conversation_summaries
+            WHERE user_id = ? AND message_type = ? {bound}
+            ORDER BY last_activity_ms DESC, chat_id DESC
+            LIMIT ?
+        ''', (user_id, message_type, *(before or ()), -1 if limit is None else limit))
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def get_friend_summaries(self, user_id, before=None, limit=None):
+        """Friends with their chat summary, most recent activity first
+        
+        Each item is the friend's profile plus last_message_id,
+        last_sender_id, preview, last_activity_ms and unread_count. To page,
+        pass before=(last_activity_ms, user_id) of the last item shown.
+        """
+        summaries = self._get_summaries(user_id, 'direct', before, limit)
+        profiles = self.get_users_by_ids([summary['chat_id'] for summary in summaries])
+        friends = []
+        for summary in summaries:
+            friend = profiles.get(summary.pop('chat_id'))
+            if friend:
+                friend.update(summary)
+                friends.append(friend)
+        return friends
+    
+    def get_group_summaries(self, user_id, before=None, limit=None):
+        """Groups with their chat summary, most recent activity first
+        
+        Items carry the same fields as get_user_groups plus the summary
+        fields. To page, pass before=(last_activity_ms, group_id) of the
+        last item shown.
+        """
+        cursor = self.conn.cursor()
+        bound = 'AND (cs.last_activity_ms, cs.chat_id) < (?, ?)' if before else ''
+        cursor.execute(f'''
+            SELECT g.*, gm.role, gm.joined_at,
+                   u.username as creator_username, u.display_name as creator_name,
+                   cs.last_message_id, cs.last_sender_id, cs.preview, cs.last_activity_ms, cs.unread_count
+            FROM conversation_summaries cs
+            JOIN groups g ON g.group_id = cs.chat_id
+            JOIN group_members gm ON gm.group_id = cs.chat_id AND gm.user_id = cs.user_id
+            JOIN users u ON g.created_by = u.user_id
+            WHERE cs.user_id = ? AND cs.message_type = 'group' {bound}
+            ORDER BY cs.last_activity_ms DESC, cs.chat_id DESC
+            LIMIT ?
+        ''', (user_id, *(before or ()), -1 if limit is None else limit))
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def get_unread_counts(self, user_id):
+        """Unread message counts of all a user's chats in one query
+        
+        Returns {'direct': {friend_id: count}, 'group': {group_id: count}}
+        holding only the chats with unread messages.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT message_type, chat_id, unread_count
+            FROM conversation_summaries
+            WHERE user_id = ? AND unread_count > 0
+        ''', (user_id,))
+        
+        counts = {'direct': {}, 'group': {}}
+        for message_type, chat_id, unread_count in cursor.fetchall():
+            counts[message_type][chat_id] = unread_count
+        return counts
     
     # ============= READ RECEIPTS =============
     
+    # Read state is a cursor per (reader, chat): a message is read when its
+    # ID is at or below the reader's last_read_message_id for that chat.
+    
+    @staticmethod
+    def _read_cursor_source(message_type, user_id):
+        """Message table plus the SQL (and parameters) giving a message's chat_id for a reader"""
+        if message_type == 'direct':
+            return 'messages', 'CASE WHEN m.sender_id = ? THEN m.receiver_id ELSE m.sender_id END', (user_id,)
+        return 'group_messages', 'm.group_id', ()
+    
+    def _advance_read_cursor(self, cursor, user_id, message_type, chat_id, message_id):
+        """Move a reader's cursor forward to message_id (never backwards)"""
+        cursor.execute('''
+            INSERT INTO read_cursors (user_id, message_type, chat_id, last_read_message_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, message_type, chat_id) DO UPDATE SET
+                last_read_message_id = MAX(last_read_message_id, excluded.last_read_message_id),
+                updated_at = CURRENT_TIMESTAMP
+        ''', (user_id, message_type, chat_id, message_id))
+    
     def mark_as_read(self, message_id, user_id, message_type='direct'):
-        """Mark a message as read"""
+        """Mark a message (and everything before it in its chat) as read"""
+        return self.mark_read([message_id], user_id, message_type)
+    
+    def mark_read(self, message_ids, user_id, message_type='direct'):
+        """Mark many messages as read in a single transaction"""
+        cursor = self.conn.cursor()
+        table, chat_expr, chat_params = self._read_cursor_source(message_type, user_id)
         try:
-            self.cursor.execute('''
-                INSERT OR REPLACE INTO read_receipts (message_id, user_id, message_type, read_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (message_id, user_id, message_type))
+            for chunk in _chunks(list(message_ids)):
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'''
+                    INSERT INTO read_cursors (user_id, message_type, chat_id, last_read_message_id)
+                    SELECT ?, ?, {chat_expr} AS chat_id, MAX(m.message_id)
+                    FROM {table} m
+                    WHERE m.message_id IN ({placeholders})
+                    GROUP BY chat_id
+                    ON CONFLICT(user_id, message_type, chat_id) DO UPDATE SET
+                        last_read_message_id = MAX(last_read_message_id, excluded.last_read_message_id),
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING chat_id, last_read_message_id
+                ''', (user_id, message_type, *chat_params, *chunk))
+                for chat_id, last_read_message_id in cursor.fetchall():
+                    self._recount_unread(cursor, user_id, message_type, chat_id, last_read_message_id)
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             return False
     
     def mark_conversation_as_read(self, user1_id, user2_id, reader_id):
         """Mark all messages in a conversation as read"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
-                SELECT message_id FROM messages
-                WHERE ((sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?))
-                AND receiver_id = ? AND is_deleted = 0
-            ''', (user1_id, user2_id, user2_id, user1_id, reader_id))
-            
-            messages = self.cursor.fetchall()
-            for msg in messages:
-                self.mark_as_read(msg['message_id'], reader_id, 'direct')
-            
+            other_id = user2_id if reader_id == user1_id else user1_id
+            cursor.execute('''
+                SELECT MAX(message_id) FROM messages WHERE conversation_id = ?
+            ''', (conversation_key(reader_id, other_id),))
+            
+            last_message_id = cursor.fetchone()[0]
+            if last_message_id is not None:
+                self._advance_read_cursor(cursor, reader_id, 'direct', other_id, last_message_id)
+                self._recount_unread(cursor, reader_id, 'direct', other_id, last_message_id)
+                self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             return False
     
     def is_message_read(self, message_id, user_id, message_type='direct'):
         """Check if a message is read by a user"""
-        self.cursor.execute('''
-            SELECT * FROM read_receipts 
-            WHERE message_id = ? AND user_id = ? AND message_type = ?
-        ''', (message_id, user_id, message_type))
-        return self.cursor.fetchone() is not None
+        return message_id in self.get_read_status([message_id], user_id, message_type)
+    
+    def get_read_status(self, message_ids, user_id, message_type='direct'):
+        """Return the subset of message_ids that user_id has read"""
+        cursor = self.conn.cursor()
+        table, chat_expr, chat_params = self._read_cursor_source(message_type, user_id)
+        read_ids = set()
+        for chunk in _chunks(list(message_ids)):
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT m.message_id
+                FROM {table} m
+                JOIN read_cursors rc
+                  ON rc.user_id = ? AND rc.message_type = ? AND rc.chat_id = {chat_expr}
+                WHERE m.message_id IN ({placeholders})
+                AND m.message_id <= rc.last_read_message_id
+            ''', (user_id, message_type, *chat_params, *chunk))
+            read_ids.update(row['message_id'] for row in cursor.fetchall())
+        return read_ids
     
     # ============= MESSAGE EDITING/DELETING =============
     
     def edit_message(self, message_id, new_text, message_type='direct'):
         """Edit a message"""
+        cursor = self.conn.cursor()
         try:
             table = 'messages' if message_type == 'direct' else 'group_messages'
-            self.cursor.execute(f'''
+            cursor.execute(f'''
                 UPDATE {table}
                 SET message_text = ?, is_edited = 1, edited_at = CURRENT_TIMESTAMP
                 WHERE message_id = ?
+                RETURNING *
             ''', (new_text, message_id))
+            message = cursor.fetchone()
+            
+            # Refresh the preview wherever this is the latest message
+            if message:
+                cursor.executemany(f'''
+                    UPDATE conversation_summaries
+                    SET preview = substr(?, 1, {self.PREVIEW_LENGTH})
+                    WHERE user_id = ? AND message_type = ? AND chat_id = ? AND last_message_id = ?
+                ''', [(new_text, user_id, message_type, chat_id, message_id)
+                      for user_id, chat_id in self._message_participants(cursor, message_type, message)])
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             return False
     
     def delete_message(self, message_id, message_type='direct'):
         """Delete a message from database (hard delete)"""
+        cursor = self.conn.cursor()
         try:
             table = 'messages' if message_type == 'direct' else 'group_messages'
             
             # First verify message exists
-            self.cursor.execute(f'SELECT message_id FROM {table} WHERE message_id = ?', (message_id,))
-            if not self.cursor.fetchone():
+            cursor.execute(f'SELECT * FROM {table} WHERE message_id = ?', (message_id,))
+            message = cursor.fetchone()
+            if not message:
                 print(f"Message {message_id} not found")
                 return False
             
             # Delete the message
-            self.cursor.execute(f'DELETE FROM {table} WHERE message_id = ?', (message_id,))
+            cursor.execute(f'DELETE FROM {table} WHERE message_id = ?', (message_id,))
+            rows_affected = cursor.rowcount
             
-            # Also delete associated reactions and read receipts
-            self.cursor.execute('''
+            # Also delete associated reactions
+            cursor.execute('''
                 DELETE FROM message_reactions 
                 WHERE message_id = ? AND message_type = ?
             ''', (message_id, message_type))
             
-            self.cursor.execute('''
-                DELETE FROM read_receipts 
-                WHERE message_id = ? AND message_type = ?
-            ''', (message_id, message_type))
-            
+            self._summarize_deleted_message(cursor, message_type, message)
             self.conn.commit()
             
             # Verify deletion
-            rows_affected = self.cursor.rowcount
             if rows_affected > 0:
                 return True
             else:
                 print(f"Warning: No rows deleted for message_id {message_id}")
                 return False
         except Exception as e:
+            self.conn.rollback()
             print(f"Error deleting message: {e}")
             import traceback
             traceback.print_exc()
@@ -1107,117 +2474,172 @@ class Database:
     
     def get_message_by_id(self, message_id, message_type='direct'):
         """Get a message by ID"""
+        cursor = self.conn.cursor()
         table = 'messages' if message_type == 'direct' else 'group_messages'
-        self.cursor.execute(f'SELECT * FROM {table} WHERE message_id = ?', (message_id,))
-        msg = self.cursor.fetchone()
+        cursor.execute(f'SELECT * FROM {table} WHERE message_id = ?', (message_id,))
+        msg = cursor.fetchone()
         return dict(msg) if msg else None
     
     # ============= MESSAGE FORWARDING =============
     
     def forward_message(self, message_id, sender_id, receiver_id, message_type='direct', forward_type='direct'):
         """Forward a message to another chat"""
+        target = (forward_type, receiver_id)
+        return self.forward_to_many(message_id, sender_id, [target], message_type)[target]
+    
+    def forward_to_many(self, message_id, sender_id, targets, message_type='direct'):
+        """Forward a message to many chats in one transaction
+        
+        targets are (forward_type, target_id) pairs, with forward_type
+        'direct' for a friend's user ID or 'group' for a group ID. The
+        original is read once and every copy points at it through
+        forwarded_from_id and reuses its image_path. Returns
+        {target: (success, message)}; targets that fail the checks are
+        skipped and the rest are forwarded.
+        """
+        targets = list(dict.fromkeys(tuple(target) for target in targets))
+        original = self.get_message_by_id(message_id, message_type)
+        if not original:
+            return {target: (False, "Message not found") for target in targets}
+        
+        forwarded_text = f"Forwarded: {original['message_text']}"
+        image_path = original.get('image_path')
+        cursor = self.conn.cursor()
         try:
-            # Get original message
-            original = self.get_message_by_id(message_id, message_type)
-            if not original:
-                return False, "Message not found"
-            
-            # Create forwarded message
-            forwarded_text = f"Forwarded: {original['message_text']}"
-            if forward_type == 'direct':
-                success, msg, new_msg_id, _ = self.send_message(sender_id, receiver_id, forwarded_text, original.get('image_path'))
-                if success and new_msg_id:
-                    # Update to mark as forwarded
-                    self.cursor.execute('''
-                        UPDATE messages SET forwarded_from_id = ?
-                        WHERE message_id = ?
-                    ''', (message_id, new_msg_id))
-                    self.conn.commit()
-                return success, msg
-            else:
-                # Forward to group
-                success = self.send_group_message(receiver_id, sender_id, forwarded_text, original.get('image_path'))
-                if success:
-                    new_msg_id = self.cursor.lastrowid
-                    self.cursor.execute('''
-                        UPDATE group_messages SET forwarded_from_id = ?
-                        WHERE message_id = ?
-                    ''', (message_id, new_msg_id))
-                    self.conn.commit()
-                return success, "Message forwarded"
+            if not self.conn.in_transaction:
+                cursor.execute('BEGIN IMMEDIATE')
+            
+            # Direct targets are checked against the cached friend and block
+            # sets, group targets with one membership query
+            group_ids = [target_id for forward_type, target_id in targets if forward_type == 'group']
+            member_of = set()
+            for chunk in _chunks(group_ids):
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT group_id FROM group_members WHERE user_id = ? AND group_id IN ({placeholders})
+                ''', (sender_id, *chunk))
+                member_of.update(row['group_id'] for row in cursor.fetchall())
+            
+            results = {}
+            direct_rows, group_rows = [], []
+            for forward_type, target_id in targets:
+                target = (forward_type, target_id)
+                if forward_type == 'group':
+                    if target_id in member_of:
+                        group_rows.append((target_id, sender_id, forwarded_text, image_path, message_id, None))
+                    else:
+                        results[target] = (False, "You are not a member of this group")
+                elif self.is_blocked(sender_id, target_id):
+                    results[target] = (False, "Cannot send message: user is blocked")
+                elif not self.are_friends(sender_id, target_id):
+                    results[target] = (False, "You must be friends to send messages")
+                else:
+                    direct_rows.append((sender_id, target_id, forwarded_text, image_path, message_id, None))
+            
+            if direct_rows:
+                self._insert_direct_messages(cursor, direct_rows)
+            if group_rows:
+                self._insert_group_messages(cursor, group_rows)
+            self.conn.commit()
+            
+            for target in targets:
+                results.setdefault(target, (True, "Message forwarded"))
+            return {target: results[target] for target in targets}
         except Exception as e:
-            return False, str(e)
+            self.conn.rollback()
+            return {target: (False, str(e)) for target in targets}
     
     # ============= MESSAGE SEARCH =============
     
-    def search_messages(self, user_id, search_query, chat_with_id=None, group_id=None):
-        """Search messages in conversations"""
+    def search_messages(self, user_id, search_query, chat_with_id=None, group_id=None, limit=100):
+        """Search messages in conversations, best matches first
+        
+        Each result carries a 'snippet' of the matching text with matched
+        terms wrapped in HIGHLIGHT_START / HIGHLIGHT_END.
+        """
+        cursor = self.conn.cursor()
         results = []
         
         if chat_with_id:
-            # Search in direct messages
-            self.cursor.execute('''
-                SELECT m.*, u.username as sender_name, u.display_name
-                FROM messages m
-                JOIN users u ON m.sender_id = u.user_id
-                WHERE ((m.sender_id = ? AND m.receiver_id = ?) OR (m.sender_id = ? AND m.receiver_id = ?))
-                AND m.message_text LIKE ?
-                ORDER BY m.sent_at DESC
-            ''', (user_id, chat_with_id, chat_with_id, user_id, f'%{search_query}%'))
-            
-            for row in self.cursor.fetchall():
-                msg = dict(row)
-                msg['sender_name'] = msg['display_name'] or msg['sender_name']
-                msg['sent_at'] = datetime.strptime(msg['sent_at'], '%Y-%m-%d %H:%M:%S')
-                results.append(msg)
-        
+            table, alias = 'messages', 'm'
+            scope = 'm.conversation_id = ?'
+            scope_params = (conversation_key(user_id, chat_with_id),)
         elif group_id:
-            # Search in group messages
-            self.cursor.execute('''
-                SELECT gm.*, u.username as sender_name, u.display_name
-                FROM group_messages gm
-                JOIN users u ON gm.sender_id = u.user_id
-                WHERE gm.group_id = ? AND gm.message_text LIKE ?
-                ORDER BY gm.sent_at DESC
-            ''', (group_id, f'%{search_query}%'))
-            
-            for row in self.cursor.fetchall():
-                msg = dict(row)
-                msg['sender_name'] = msg['display_name'] or msg['sender_name']
-                msg['sent_at'] = datetime.strptime(msg['sent_at'], '%Y-%m-%d %H:%M:%S')
-                results.append(msg)
+            table, alias = 'group_messages', 'gm'
+            scope = 'gm.group_id = ?'
+            scope_params = (group_id,)
+        else:
+            return results
+        
+        match = _fts_query(search_query)
+        if not match:
+            return results
+        
+        if self.has_search_index:
+            # Search the index, then keep the hits from this chat
+            cursor.execute(f'''
+                SELECT {alias}.*, snippet({table}_fts, 0, ?, ?, '…', 16) as snippet
+                FROM {table}_fts
+                JOIN {table} {alias} ON {alias}.message_id = {table}_fts.rowid
+                WHERE {table}_fts MATCH ? AND {scope}
+                ORDER BY bm25({table}_fts)
+                LIMIT ?
+            ''', (HIGHLIGHT_START, HIGHLIGHT_END, match, *scope_params, limit))
+        else:
+            cursor.execute(f'''
+                SELECT {alias}.*, {alias}.message_text as snippet
+                FROM {table} {alias}
+                WHERE {scope} AND {alias}.message_text LIKE ?
+                ORDER BY {alias}.message_id DESC
+                LIMIT ?
+            ''', (*scope_params, f'%{search_query}%', limit))
         
+        results = _fetch_messages(cursor)
+        self._attach_sender_names(results)
         return results
     
     # ============= CLEAR CHAT =============
     
     def clear_conversation(self, user1_id, user2_id):
         """Clear all messages in a conversation"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
-                DELETE FROM messages
-                WHERE ((sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?))
-            ''', (user1_id, user2_id, user2_id, user1_id))
+            cursor.execute('''
+                DELETE FROM messages WHERE conversation_id = ?
+            ''', (conversation_key(user1_id, user2_id),))
+            self._rebuild_summaries(cursor, 'direct',
+                                    self._chat_participants(cursor, 'direct', user2_id, user1_id))
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             return False
     
     def clear_group_chat(self, group_id):
         """Clear all messages in a group chat"""
+        cursor = self.conn.cursor()
         try:
-            self.cursor.execute('''
+            cursor.execute('''
                 DELETE FROM group_messages WHERE group_id = ?
             ''', (group_id,))
+            self._rebuild_summaries(cursor, 'group', self._chat_participants(cursor, 'group', group_id))
             self.conn.commit()
             return True
         except Exception as e:
+            self.conn.rollback()
             return False
     
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
+        """Close every pooled connection"""
+        with self._pool_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._clear_caches()
+        self._cache_epoch = None
+        self._cache_checked = 0.0
 
 # Test the database
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A migrated database in a temp directory with the sample users"""
+    database = Database(str(tmp_path / 'chat_app.db'))
+    yield database
+    database.close()
@@ -0,0 +1,62 @@
+"""The social graph caches against writes from this and other connections"""
+import pytest
+
+from database import Database
+
+ALICE, BOB, CHARLIE = 1, 2, 3
+
+
+@pytest.fixture
+def two_processes(tmp_path):
+    """Two Database instances on one file, with alice and bob friends"""
+    path = str(tmp_path / 'chat_app.db')
+    first, second = Database(path), Database(path)
+    first.send_friend_request(ALICE, 'bob')
+    first.respond_to_friend_request(first.get_pending_friend_requests(BOB)[0]['request_id'], BOB)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_send_sees_a_block_from_another_connection_at_once(two_processes):
+    first, second = two_processes
+    assert first.send_message(ALICE, BOB, 'hi')[0]
+    
+    assert second.block_user(BOB, 'alice')[0]
+    success, msg, _, _ = first.send_message(ALICE, BOB, 'hi again')
+    assert not success, msg
+    assert first.send_messages_batch([(ALICE, BOB, 'and again')])[0] is False
+
+
+def test_group_send_sees_a_removal_from_another_connection_at_once(two_processes):
+    first, second = two_processes
+    group_id = first.create_group('Team', '', ALICE)
+    first.invite_to_group(group_id, ALICE, BOB)
+    first.respond_to_invite(first.get_pending_invites(BOB)[0]['invite_id'], BOB)
+    assert first.send_group_message(group_id, BOB, 'hello')
+    
+    assert second.remove_member(group_id, ALICE, BOB)[0]
+    assert not first.send_group_message(group_id, BOB, 'still here?')
+
+
+def test_own_writes_keep_the_caches(two_processes):
+    first, _ = two_processes
+    first.send_friend_request(ALICE, 'charlie')
+    first.respond_to_friend_request(first.get_pending_friend_requests(CHARLIE)[0]['request_id'], CHARLIE)
+    assert first.are_friends(ALICE, CHARLIE) and first.are_friends(BOB, ALICE)
+    
+    first.remove_friendship(ALICE, BOB)
+    first._cache_checked = 0.0
+    assert not first.are_friends(ALICE, BOB)
+    # Patched in place rather than dropped and reloaded
+    assert CHARLIE in first._friends[ALICE]
+    assert BOB in first._friends
+
+
+def test_foreign_writes_still_drop_the_caches(two_processes):
+    first, second = two_processes
+    assert first.are_friends(ALICE, BOB)
+    
+    second.remove_friendship(ALICE, BOB)
+    first._cache_checked = 0.0
+    assert not first.are_friends(ALICE, BOB)
@@ -0,0 +1,155 @@
+"""Many threads sharing one Database
+
+Each worker thread is one user: it sends direct and group messages,
+reads history and marks it read. Afterwards every send must be stored
+and every conversation summary must match a recount from the messages.
+"""
+import random
+import threading
+
+import pytest
+
+from database import Database, conversation_key
+
+USERS = 8
+ROUNDS = 15
+
+
+def build(path, pool_size):
+    """A database where USERS users are all friends and share one group"""
+    db = Database(str(path), pool_size=pool_size)
+    for index in range(4, USERS + 1):
+        db.register_user(f'user{index}', 'password123', f'User {index}')
+    user_ids = [row[0] for row in db.conn.execute('SELECT user_id FROM users ORDER BY user_id')]
+    
+    usernames = {user['user_id']: user['username'] for user in db.get_users_by_ids(user_ids).values()}
+    for index, requester_id in enumerate(user_ids):
+        for recipient_id in user_ids[index + 1:]:
+            db.send_friend_request(requester_id, usernames[recipient_id])
+    for user_id in user_ids:
+        for request in db.get_pending_friend_requests(user_id):
+            db.respond_to_friend_request(request['request_id'], user_id)
+    
+    group_id = db.create_group('Everyone', 'All users', user_ids[0])
+    db.invite_many(group_id, user_ids[0], user_ids[1:])
+    for user_id in user_ids[1:]:
+        db.respond_to_invite(db.get_pending_invites(user_id)[0]['invite_id'], user_id)
+    return db, user_ids, group_id
+
+
+def chat_as(db, user_id, peers, group_id, seed, sent, errors):
+    """One user's mixed workload; counts its sends and collects failures"""
+    rng = random.Random(seed)
+    try:
+        for _ in range(ROUNDS):
+            peer_id = rng.choice(peers)
+            success, msg, _, _ = db.send_message(user_id, peer_id, f'hi {peer_id}')
+            assert success, msg
+            sent['direct'] += 1
+            
+            assert db.send_group_message(group_id, user_id, f'hello from {user_id}')
+            sent['group'] += 1
+            
+            history = db.get_conversation(user_id, rng.choice(peers))
+            if history:
+                assert db.mark_as_read(history[-1]['message_id'], user_id)
+            
+            group_history = db.get_group_messages(group_id, user_id, limit=5)
+            assert db.mark_read([message['message_id'] for message in group_history], user_id, 'group')
+            db.get_friend_summaries(user_id, limit=10)
+            db.get_unread_counts(user_id)
+    except Exception as e:
+        errors.append(f"user {user_id}: {e!r}")
+
+
+def summary_mismatches(db):
+    """Summaries whose last message or unread count differ from a recount"""
+    conn = db.conn
+    mismatches = []
+    rows = conn.execute('''
+        SELECT s.user_id, s.message_type, s.chat_id, s.last_message_id, s.unread_count,
+               COALESCE(rc.last_read_message_id, 0) AS last_read
+        FROM conversation_summaries s
+        LEFT JOIN read_cursors rc ON rc.user_id = s.user_id
+            AND rc.message_type = s.message_type AND rc.chat_id = s.chat_id
+    ''').fetchall()
+    for row in rows:
+        if row['message_type'] == 'direct':
+            table, column = 'messages', 'conversation_id'
+            chat_key = conversation_key(row['user_id'], row['chat_id'])
+        else:
+            table, column = 'group_messages', 'group_id'
+            chat_key = row['chat_id']
+        last_id, unread = conn.execute(f'''
+            SELECT MAX(message_id),
+                   SUM(message_id > ? AND sender_id != ?)
+            FROM {table} WHERE {column} = ?
+        ''', (row['last_read'], row['user_id'], chat_key)).fetchone()
+        if (row['last_message_id'], row['unread_count']) != (last_id, unread or 0):
+            mismatches.append((tuple(row), last_id, unread))
+    return mismatches
+
+
+@pytest.mark.parametrize('pool_size, threads', [
+    (8, USERS - 1),
+    # More threads than connections: workers wait in _acquire_connection
+    # for a finished thread to hand its connection back
+    (3, USERS),
+])
+def test_concurrent_sends_and_reads(tmp_path, pool_size, threads):
+    db, user_ids, group_id = build(tmp_path / 'chat_app.db', pool_size)
+    try:
+        direct_before = db.conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        group_before = db.conn.execute('SELECT COUNT(*) FROM group_messages').fetchone()[0]
+        
+        sent = [{'direct': 0, 'group': 0} for _ in range(threads)]
+        errors = []
+        workers = [threading.Thread(target=chat_as, args=(
+            db, user_id, [peer for peer in user_ids if peer != user_id], group_id,
+            index, sent[index], errors)) for index, user_id in enumerate(user_ids[:threads])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        
+        assert not errors
+        assert len(db._connections) <= pool_size
+        
+        direct_after = db.conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        group_after = db.conn.execute('SELECT COUNT(*) FROM group_messages').fetchone()[0]
+        assert direct_after - direct_before == sum(counts['direct'] for counts in sent) == threads * ROUNDS
+        assert group_after - group_before == sum(counts['group'] for counts in sent) == threads * ROUNDS
+        
+        assert summary_mismatches(db) == []
+    finally:
+        db.close()
+
+
+def test_failed_write_releases_the_write_lock(tmp_path):
+    db, user_ids, _ = build(tmp_path / 'chat_app.db', 8)
+    try:
+        alice, bob, charlie = user_ids[:3]
+        db.remove_friendship(alice, bob)
+        # The accepted request is still there, so this insert hits its UNIQUE constraint
+        success, _ = db.send_friend_request(alice, 'bob')
+        assert not success
+        assert not db.conn.in_transaction
+        
+        results = []
+        other = threading.Thread(target=lambda: results.append(db.send_message(bob, charlie, 'still here')))
+        other.start()
+        other.join()
+        assert results[0][0], results[0][1]
+    finally:
+        db.close()
+
+
+def test_memory_database_is_limited_to_one_connection():
+    with pytest.raises(ValueError):
+        Database(':memory:', pool_size=4)
+    db = Database(':memory:')
+    try:
+        assert db.pool_size == 1
+        assert db.register_user('zed', 'password123')[0]
+    finally:
+        db.close()
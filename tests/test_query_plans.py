@@ -0,0 +1,150 @@
+"""Every statement a public Database method runs must use an index
+
+Each method is called against a small migrated database with its caches
+cleared and tracing on, and every traced statement is run again under
+EXPLAIN QUERY PLAN. Any full table scan fails the test unless it is
+listed in EXPECTED_SCANS.
+"""
+import pytest
+
+# (method, table) -> why scanning it is fine
+EXPECTED_SCANS = {
+    ('get_all_users', 'users'): "returns every user, in username order",
+}
+
+SKIPPED_PREFIXES = ('--', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA')
+
+ALICE, BOB, CHARLIE, DAVE = 1, 2, 3, 4
+
+
+@pytest.fixture
+def seeded(db):
+    """Friends alice-bob and alice-charlie, a group and a few messages in each chat"""
+    db.register_user('dave', 'password123', 'Dave')
+    for username in ('bob', 'charlie'):
+        db.send_friend_request(ALICE, username)
+    for request in db.get_pending_friend_requests(BOB) + db.get_pending_friend_requests(CHARLIE):
+        db.respond_to_friend_request(request['request_id'], request['recipient_id'])
+    group_id = db.create_group('Team', 'Planning', ALICE)
+    db.invite_to_group(group_id, ALICE, BOB)
+    db.respond_to_invite(db.get_pending_invites(BOB)[0]['invite_id'], BOB)
+    
+    direct_ids = db.send_messages_batch([(ALICE, BOB, 'hello bob'), (BOB, ALICE, 'hello alice'),
+                                         (ALICE, CHARLIE, 'hello charlie')])[2]
+    group_ids = db.send_group_messages_batch(group_id, [(ALICE, 'hello team'), (BOB, 'hi all')])
+    return db, group_id, direct_ids, group_ids
+
+
+def calls(group_id, direct_ids, group_ids):
+    """(method, args) for every public method, in an order that keeps the data valid"""
+    return [
+        ('login_user', ('alice', 'password123')),
+        ('register_user', ('erin', 'password123', 'Erin')),
+        ('get_user_by_id', (ALICE,)),
+        ('get_users_by_ids', ([ALICE, BOB, CHARLIE],)),
+        ('get_all_users', ()),
+        ('get_all_users', (group_id,)),
+        ('update_profile', (ALICE, 'Alice J', '1990-01-01', 'NZ', 'Hi')),
+        ('change_password', (ALICE, 'password123')),
+        ('send_message', (ALICE, BOB, 'another')),
+        ('send_messages_batch', ([(ALICE, BOB, 'one'), (ALICE, CHARLIE, 'two')],)),
+        ('get_conversation', (ALICE, BOB)),
+        ('get_conversation', (ALICE, BOB, direct_ids[-1])),
+        ('get_conversation', (ALICE, BOB, None, direct_ids[0])),
+        ('send_friend_request', (BOB, 'charlie')),
+        ('get_pending_friend_requests', (CHARLIE,)),
+        ('respond_to_friend_request', (3, CHARLIE, False)),
+        ('are_friends', (ALICE, BOB)),
+        ('get_friends', (ALICE,)),
+        ('get_friends', (ALICE, 'bob', 10)),
+        ('is_blocked', (ALICE, BOB)),
+        ('update_streak', (ALICE, BOB)),
+        ('get_streak', (ALICE, BOB)),
+        ('create_group', ('Other', 'Second group', BOB)),
+        ('get_user_groups', (ALICE,)),
+        ('get_group_by_id', (group_id,)),
+        ('get_group_members', (group_id,)),
+        ('invite_to_group', (group_id, ALICE, CHARLIE)),
+        ('invite_many', (group_id, ALICE, [CHARLIE, DAVE])),
+        ('get_pending_invites', (CHARLIE,)),
+        ('respond_to_invite', (2, CHARLIE)),
+        ('send_group_message', (group_id, ALICE, 'more')),
+        ('send_group_messages_batch', (group_id, [(ALICE, 'a'), (BOB, 'b')])),
+        ('get_group_messages', (group_id, ALICE)),
+        ('get_group_messages', (group_id, ALICE, group_ids[-1])),
+        ('get_group_messages', (group_id, ALICE, None, group_ids[0])),
+        ('add_reaction', (direct_ids[0], BOB, 'like')),
+        ('get_message_reactions', (direct_ids[0],)),
+        ('get_reactions_for_messages', (direct_ids,)),
+        ('remove_reaction', (direct_ids[0], BOB)),
+        ('get_friend_summaries', (ALICE,)),
+        ('get_friend_summaries', (ALICE, (0, BOB), 10)),
+        ('get_group_summaries', (ALICE,)),
+        ('get_unread_counts', (ALICE,)),
+        ('mark_as_read', (direct_ids[1], ALICE)),
+        ('mark_read', (group_ids, CHARLIE, 'group')),
+        ('mark_conversation_as_read', (ALICE, BOB, ALICE)),
+        ('is_message_read', (direct_ids[0], BOB)),
+        ('get_read_status', (direct_ids, BOB)),
+        ('get_message_by_id', (direct_ids[0],)),
+        ('edit_message', (direct_ids[0], 'edited')),
+        ('forward_message', (direct_ids[0], ALICE, CHARLIE)),
+        ('forward_to_many', (group_ids[0], ALICE, [('direct', BOB), ('group', group_id)], 'group')),
+        ('search_messages', (ALICE, 'hello')),
+        ('search_messages', (ALICE, 'hello', BOB)),
+        ('search_messages', (ALICE, 'hello', None, group_id)),
+        ('delete_message', (direct_ids[2],)),
+        ('leave_group', (group_id, CHARLIE)),
+        ('remove_member', (group_id, ALICE, BOB)),
+        ('block_user', (ALICE, 'charlie')),
+        ('get_blocked_users', (ALICE,)),
+        ('unblock_user', (ALICE, CHARLIE)),
+        ('remove_friendship', (ALICE, BOB)),
+        ('clear_conversation', (ALICE, CHARLIE)),
+        ('clear_group_chat', (group_id,)),
+    ]
+
+
+def table_scans(conn, sql):
+    """Tables a statement reads with a full scan"""
+    scans = set()
+    for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}'):
+        detail = row['detail']
+        if detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail and 'CONSTANT ROW' not in detail:
+            scans.add(detail.split()[1])
+    return scans
+
+
+def test_public_methods_use_indexes(seeded):
+    db, group_id, direct_ids, group_ids = seeded
+    conn = db.conn
+    
+    unexpected = []
+    for name, args in calls(group_id, direct_ids, group_ids):
+        # Start cold, so the queries behind the caches run too
+        db._clear_caches()
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            getattr(db, name)(*args)
+        finally:
+            conn.set_trace_callback(None)
+        
+        for sql in dict.fromkeys(statements):
+            if sql.lstrip().upper().startswith(SKIPPED_PREFIXES):
+                continue
+            for table in table_scans(conn, sql):
+                if (name, table) not in EXPECTED_SCANS:
+                    unexpected.append(f"{name}: SCAN {table}\n    {' '.join(sql.split())}")
+    
+    assert not unexpected, "Unexpected full scans:\n" + "\n".join(unexpected)
+
+
+def test_every_public_method_is_checked(seeded):
+    db, group_id, direct_ids, group_ids = seeded
+    checked = {name for name, _ in calls(group_id, direct_ids, group_ids)}
+    public = {name for name in dir(type(db)) if not name.startswith('_')
+              and callable(getattr(type(db), name))}
+    # Schema setup and connection handling run no per-user queries
+    public -= {'connect', 'create_tables', 'create_sample_data', 'close'}
+    assert public <= checked, f"Methods without a query plan check: {sorted(public - checked)}"